@@ -1,8 +1,6 @@
         add_testusers = False
         if add_testusers:
             # Quickly addding friends
-            user_config = self.db.table("user_config")
-            UserQ = Query()
             # JCoconut
             new_entry = {   
                             "user" : "330955309763788800",
@@ -11,7 +9,7 @@
                             "notifications_server_id" : "563903641631719429",
                             "notifications_group_pass" : "11118888"
                         }
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             # Deej
             new_entry = {   
                             "user" : "523211690213376005",
@@ -20,7 +18,7 @@
                             "notifications_server_id" : "563903641631719429",
                             "notifications_group_pass" : "11118888"
                         }
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             # NL
             new_entry = {   
                             "user" : "464342606898397186",
@@ -30,7 +28,7 @@
                             "notifications_group_pass" : "11118888"
                         }
             # Valharke
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             new_entry = {   
                             "user" : "745642457101893643",
                             "notifications_active" : True, 
@@ -39,7 +37,7 @@
                             "notifications_group_pass" : "11118888"
                         }
             # Eri
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             new_entry = {   
                             "user" : "211526001354735618",
                             "notifications_active" : True, 
@@ -48,7 +46,7 @@
                             "notifications_group_pass" : "11118888"
                         }
             # Kambe
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             new_entry = {   
                             "user" : "535900115483885581",
                             "notifications_active" : True, 
@@ -57,7 +55,7 @@
                             "notifications_group_pass" : "11118888"
                         }
             # Levo
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             new_entry = {   
                             "user" : "404597649585471490",
                             "notifications_active" : True, 
@@ -65,7 +63,7 @@
                             "notifications_server_id" : "563903641631719429",
                             "notifications_group_pass" : "11118888"
                         }
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))
+            self.db.upsert_user_config(new_entry)
             # Thaissing
             new_entry = {   
                             "user" : "210436307032342528",
@@ -74,7 +72,7 @@
                             "notifications_server_id" : "737637662764171375",
                             "notifications_group_pass" : "11118888"
                         }
-            user_config.upsert(new_entry, UserQ.user == str(new_entry["user"]))        
+            self.db.upsert_user_config(new_entry)        
             
         add_testdata = False
         if add_testdata:
@@ -97,7 +95,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item)
+            self.db.insert_game(new_item)
             new_item = {    "code": "663NB4R", 
                             "map": 1, 
                             "server_only" : False,
@@ -111,7 +109,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
+            self.db.insert_game(new_item) 
             new_item = {    "code": "748P526", 
                             "map": 2, 
                             "server_only" : True,
@@ -130,7 +128,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
+            self.db.insert_game(new_item) 
             new_item = {    "code": "9996W96", 
                             "map": 3, 
                             "server_only" : False,
@@ -164,7 +162,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
+            self.db.insert_game(new_item) 
             new_item = {    "code": "8896W96", 
                             "map": 4, 
                             "server_only" : False,
@@ -188,7 +186,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
+            self.db.insert_game(new_item) 
             new_item = {    "code": "9999526", 
                             "map": 5, 
                             "server_only" : False,
@@ -212,7 +210,7 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
+            self.db.insert_game(new_item) 
             new_item = {    "code": "123526", 
                             "map": 5, 
                             "server_only" : True,
@@ -231,4 +229,4 @@
                                     },
                                 ],
                         }
-            self.db.insert(new_item) 
\ No newline at end of file
+            self.db.insert_game(new_item) 
\ No newline at end of file
@@ -0,0 +1,23 @@
+# Compares the pictures as they are with the optimized variants, nothing else. Reusing uploads by link is not counted here.
+# Run from the main directory: python devtools/benchmark_assets.py
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fee_assets import AssetCache, Image
+
+if not Image:
+    print("Pillow is not installed, there are no optimized variants to compare.")
+    sys.exit(1)
+
+original = AssetCache(optimize=False)
+optimized = AssetCache(optimize=True)
+
+print("Bytes per picture, original and optimized variant")
+for status in original.pictures.keys():
+    before = sum(len(picture) for picture in original.pictures[status].values())
+    after = sum(len(picture) for picture in optimized.pictures[status].values())
+    count = len(original.pictures[status])
+    print(status + " (" + str(count) + " pictures):")
+    print("  before            " + str(before) + " bytes, " + str(before // count) + " per picture")
+    print("  after             " + str(after) + " bytes, " + str(after // count) + " per picture")
+    print("  saved             " + str(round(100 - 100 * after / before, 1)) + "%")
@@ -0,0 +1,116 @@
+import hashlib
+import io
+import logging
+import os
+import random
+import time
+import interactions
+
+# Pillow is optional. Without it the pictures are sent as they are.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# The pictures shown when a game is finished, loaded into memory once instead of read from disk for every message.
+# Once a picture was uploaded to discord, its attachment URL is remembered and later embeds link to it instead of uploading it again.
+# With optimize on, every picture is sent as a smaller variant: at most max_side pixels wide and high, recompressed.
+# The variants are made once and cached in cache_directory, named after the hash of the original picture.
+class AssetCache:
+    def __init__(self, directory="ressources", statuses=("success", "finished"), url_max_age=3600, optimize=True, max_side=800, quality=80, cache_directory="ressources/optimized"):
+        self.directory = directory
+        # status -> picture name -> bytes
+        self.pictures = {}
+        # picture name -> (uploaded_at, attachment url). Discord attachment URLs expire after a while, so they are only reused for url_max_age seconds.
+        self.uploaded_urls = {}
+        self.url_max_age = url_max_age
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_directory = cache_directory
+        if optimize and not Image:
+            logging.info("AssetCache: Pillow is not installed, sending the original pictures")
+            optimize = False
+        for status in statuses:
+            self.pictures[status] = {}
+            status_directory = os.path.join(directory, status)
+            for name in sorted(os.listdir(status_directory)):
+                with open(os.path.join(status_directory, name), mode='rb') as picture_file:
+                    picture = picture_file.read()
+                if optimize:
+                    name, picture = self.optimized_variant(name, picture)
+                self.pictures[status][name] = picture
+        logging.info("AssetCache: Loaded " + str(sum(len(pictures) for pictures in self.pictures.values())) + " pictures from " + directory + ", " + str(self.total_bytes()) + " bytes")
+
+    def total_bytes(self):
+        return sum(len(picture) for pictures in self.pictures.values() for picture in pictures.values())
+
+    # Returns the name and bytes of the smaller variant of a picture. Falls back to the original if the variant would not be smaller.
+    def optimized_variant(self, name, picture):
+        source_hash = hashlib.sha256(picture).hexdigest()
+        settings = str(self.max_side) + "_" + str(self.quality)
+        for extension in [".jpg", ".png", os.path.splitext(name)[1].lower()]:
+            cached_path = os.path.join(self.cache_directory, source_hash + "_" + settings + extension)
+            if os.path.isfile(cached_path):
+                with open(cached_path, mode='rb') as cached_file:
+                    return self._variant_name(name, extension), cached_file.read()
+
+        try:
+            image = Image.open(io.BytesIO(picture))
+            image.load()
+            image.thumbnail((self.max_side, self.max_side))
+            output = io.BytesIO()
+            # Pictures with transparency stay PNG, everything else becomes JPEG
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                extension = ".png"
+                image.save(output, format="PNG", optimize=True)
+            else:
+                extension = ".jpg"
+                image.convert("RGB").save(output, format="JPEG", quality=self.quality, optimize=True, progressive=True)
+            variant = output.getvalue()
+        except Exception as e:
+            logging.info("AssetCache: Could not optimize " + name + ", sending the original. " + str(e))
+            return name, picture
+
+        if len(variant) >= len(picture):
+            # Keep the original, but remember the decision so we don't try again on every start
+            extension = os.path.splitext(name)[1].lower()
+            variant = picture
+        os.makedirs(self.cache_directory, exist_ok=True)
+        with open(os.path.join(self.cache_directory, source_hash + "_" + settings + extension), mode='wb') as cached_file:
+            cached_file.write(variant)
+        logging.info("AssetCache: Optimized " + name + " from " + str(len(picture)) + " to " + str(len(variant)) + " bytes")
+        return self._variant_name(name, extension), variant
+
+    def _variant_name(self, name, extension):
+        return os.path.splitext(name)[0] + extension
+
+    def random_picture(self, status):
+        return random.choice(list(self.pictures[status].keys()))
+
+    def picture_bytes(self, status, name):
+        return self.pictures[status][name]
+
+    # A new file object for every send, they can only be read once
+    def picture_file(self, status, name):
+        return interactions.File(
+            filename=name,
+            fp=io.BytesIO(self.picture_bytes(status, name)),
+            description=str("Fee coop file")
+            )
+
+    # Remembers where discord put an uploaded picture. Expects the message which carried the picture.
+    def remember_upload(self, name, message):
+        try:
+            for attachment in message.attachments:
+                if attachment.filename == name:
+                    self.uploaded_urls[name] = (time.monotonic(), attachment.url)
+                    return
+        except Exception as e:
+            logging.info("AssetCache: Could not read the attachment url of " + name + ", " + str(e))
+
+    # URL of an earlier upload of the picture, or None if it has to be uploaded
+    def uploaded_url(self, name):
+        uploaded = self.uploaded_urls.get(name)
+        if uploaded and uploaded[0] + self.url_max_age > time.monotonic():
+            return uploaded[1]
+        return None
@@ -0,0 +1,190 @@
+import asyncio
+import collections
+import logging
+import time
+import interactions
+
+# The few things we need from discord users and guilds to render games. Small and immutable, so they can be shared everywhere.
+CachedUser = collections.namedtuple("CachedUser", ["id", "username", "discriminator", "avatar_url"])
+CachedGuild = collections.namedtuple("CachedGuild", ["id", "name", "icon_url"])
+
+# Cache for discord user and guild lookups. Entries expire after ttl seconds, and the least recently used ones are dropped once max_size is reached.
+class DiscordObjectCache:
+    def __init__(self, bot, ttl=900, max_size=10000):
+        self.bot = bot
+        self.ttl = ttl
+        self.max_size = max_size
+        # (kind, id) -> (expires_at, value), least recently used first
+        self.entries = collections.OrderedDict()
+        # (kind, id) -> running lookup, so the same object is never fetched twice at the same time
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_user(self, user_id):
+        return await self._get("user", str(user_id), self._fetch_user)
+
+    async def get_guild(self, guild_id):
+        return await self._get("guild", str(guild_id), self._fetch_guild)
+
+    async def _fetch_user(self, user_id):
+        userobj = await interactions.get(self.bot, interactions.User, object_id=user_id)
+        return CachedUser(id=str(userobj.id), username=userobj.username, discriminator=userobj.discriminator, avatar_url=userobj.avatar_url)
+
+    async def _fetch_guild(self, guild_id):
+        serverobj = await interactions.get(self.bot, interactions.Guild, object_id=guild_id)
+        return CachedGuild(id=str(serverobj.id), name=serverobj.name, icon_url=serverobj.icon_url)
+
+    async def _get(self, kind, object_id, fetch):
+        key = (kind, object_id)
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        task = self.pending.get(key)
+        if not task:
+            task = asyncio.ensure_future(fetch(object_id))
+            self.pending[key] = task
+            try:
+                value = await task
+            finally:
+                del self.pending[key]
+            self.put(kind, object_id, value)
+            return value
+        return await task
+
+    # Looks up many users and guilds at once, at most concurrency requests at the same time.
+    # Afterwards they are in the cache, so rendering does not wait for discord one lookup after another.
+    async def prefetch(self, user_ids=(), guild_ids=(), concurrency=10):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(lookup, object_id):
+            async with semaphore:
+                return await lookup(object_id)
+
+        lookups = [limited(self.get_user, user_id) for user_id in set(user_ids) if user_id]
+        lookups += [limited(self.get_guild, guild_id) for guild_id in set(guild_ids) if guild_id]
+        results = await asyncio.gather(*lookups, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.info("DiscordObjectCache: Prefetch failed, " + str(result))
+
+    # Also used to feed objects into the cache which we got anyway, for example ctx.user
+    def put(self, kind, object_id, value):
+        key = (kind, str(object_id))
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = 0
+        if lookups:
+            hit_rate = round(100 * self.hits / lookups)
+        return "DiscordObjectCache: " + str(len(self.entries)) + " entries, " + str(self.hits) + " hits, " + str(self.misses) + " misses (" + str(hit_rate) + "% hit rate)"
+
+# Criteria of a game list page. Pages with the same key show the same games in the same order.
+# after: (last activity, doc_id) of the game the page starts behind, None for the first page. backwards: The page is the one before after.
+# server_games: Only the games which want to stay on server_id. Lists of all servers are rendered once without a server_id and get these games merged in.
+GameListKey = collections.namedtuple("GameListKey", ["status", "group_pass", "server_only", "server_id", "mygames", "participant", "after", "backwards", "server_games"], defaults=[None, False, False])
+# What a game list needs to know about a game to decide if the game shows up in it
+GameSummary = collections.namedtuple("GameSummary", ["status", "group_pass", "server_only", "host_server", "users"])
+# One rendered game of a list, without the parts that depend on who looks at the list. position: (last activity, doc_id), where the game is in the list.
+# The host server is named only on other servers, so its name comes separately: server_name is " (server <name>)", or "" if the game has no host server.
+RenderedGame = collections.namedtuple("RenderedGame", ["doc_id", "label", "first_line", "host_name", "host_server", "server_name", "players_line", "map_name", "emoji", "users", "position"])
+
+# Rendered game list pages by their criteria. A game change only drops the pages of lists which show or showed that game.
+# Entries also expire after max_age seconds, because user and server names can change without us noticing.
+# Rendering takes a while. generation counts the game changes, so a page rendered while a game changed is not cached with outdated games.
+class GameListCache:
+    def __init__(self, max_age=900, max_size=1000):
+        self.max_age = max_age
+        self.max_size = max_size
+        # key -> (rendered_at, rendered games), least recently used first
+        self.entries = collections.OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry[0] + self.max_age > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    # generation: The generation from before the page was rendered. If a game changed meanwhile, the page is not cached.
+    def put(self, key, rendered_games, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[key] = (time.monotonic(), rendered_games)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # Can a list with this key show the game? Errs on the side of yes, that only costs an extra render.
+    def can_show(self, key, game):
+        if game is None:
+            return False
+        if key.status and game.status != key.status:
+            return False
+        if key.group_pass:
+            if game.group_pass != key.group_pass:
+                return False
+        elif not key.mygames and game.group_pass:
+            return False
+        if key.participant and key.participant not in game.users:
+            return False
+        if key.server_games and not game.server_only:
+            return False
+        if (key.server_only or game.server_only) and game.host_server != key.server_id:
+            return False
+        return True
+
+    # Drops every list that showed the game before the change or shows it after the change
+    def invalidate_game(self, old_game, new_game):
+        self.generation += 1
+        for key in list(self.entries.keys()):
+            if self.can_show(key, old_game) or self.can_show(key, new_game):
+                del self.entries[key]
+
+    def stats(self):
+        return "GameListCache: " + str(len(self.entries)) + " lists, " + str(self.hits) + " hits, " + str(self.misses) + " misses"
+
+# The shared part of private messages which go to many users at once, like the embed about a new game.
+# Rendered for the first recipient and reused for everyone else. Dropped when the game changes, so nobody gets outdated information.
+class BroadcastCache:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        # (kind, doc_id, ...) -> (rendered_at, value)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry[0] + self.max_age > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        now = time.monotonic()
+        # Broadcasts are short, so everything old can go
+        for old_key in [old_key for old_key, entry in self.entries.items() if entry[0] + self.max_age <= now]:
+            del self.entries[old_key]
+        self.entries[key] = (now, value)
+
+    def invalidate_game(self, doc_id):
+        for key in [key for key in self.entries.keys() if key[1] == doc_id]:
+            del self.entries[key]
+
+    def stats(self):
+        return "BroadcastCache: " + str(len(self.entries)) + " broadcasts, " + str(self.hits) + " hits, " + str(self.misses) + " misses"
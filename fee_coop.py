@@ -1,15 +1,21 @@
 import asyncio
-import random 
-import calendar
+import itertools
 import datetime
 import logging
-import json
 import interactions
 from interactions import Button, SelectMenu, SelectOption, spread_to_rows, autodefer
 import os
 from dotenv import dotenv_values
 from helpers import *
-from tinydb import TinyDB, Query
+from fee_storage import SqliteStorage, JournalStorage
+from fee_index import GameIndex, ActivityIndex, ExpiryQueue, PinboardIndex, SubscriberIndex, GroupPassHistory
+from fee_cache import DiscordObjectCache, GameListCache, GameListKey, GameSummary, RenderedGame, BroadcastCache
+from fee_pinboards import PinboardRefreshQueue, PinboardChannelActivity
+from fee_dm import DmQueue
+from fee_outbox import Outbox
+from fee_assets import AssetCache
+from fee_maps import MapCatalog
+from fee_models import Game, Turn, now_micros, micros_to_datetime, micros_to_unix, timedelta_to_micros, MICROS_PER_DAY
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt="%Y-%m-%d %H:%M:%S", level=logging.INFO, handlers=[logging.FileHandler('logs/fee_coop.log'),logging.StreamHandler()])
@@ -20,87 +26,315 @@ logging.info("Initializing script from " + app_base_dir)
 # load env variables
 config = dotenv_values(app_base_dir + '/.env')
 debug_mode=bool(config['DEBUG_MODE'] == "True")
+# Open games without any activity for this long are abandoned automatically (more than 2 full days)
+purge_after = datetime.timedelta(days=3)
+# A page of a game list shows at most this many games, a select menu can't take more. Pages also end before the description passes 4096 characters.
+games_per_page = 25
+# "sqlite" or "journal" (everything in memory, changes appended to a journal file)
+storage_backend=config.get('STORAGE_BACKEND', "sqlite")
+# Pinboards get refreshed at most once in this many seconds, no matter how many games change in between
+pinboard_debounce_seconds=float(config.get('PINBOARD_DEBOUNCE_SECONDS', 5))
+# How many pinboards get refreshed at the same time
+pinboard_concurrency=int(config.get('PINBOARD_CONCURRENCY', 5))
+# Private messages are sent by this many workers, all together at most one every DM_INTERVAL seconds
+dm_workers=int(config.get('DM_WORKERS', 3))
+dm_interval=float(config.get('DM_INTERVAL', 0.5))
 
 # Discord interactions extension class
 class FeeCoop(interactions.Extension):
     def __init__(self, client):
         self.bot: interactions.Client = client
-        # All information about our maps. Index = Map number
-        self.mapdata = []
-        with open("ressources/mapdata.json", "r") as json_file:
-            self.mapdata = json.load(json_file)
-        # Maps are also represented as emoji
-        self.emoji = {}
-        with open("ressources/emoji.json", "r") as json_file:
-            self.emoji = json.load(json_file)
-
-        # Active games from database
-        self.db = TinyDB('db.json')
+        # All information about our maps and their emoji, prepared once. Index = Map number
+        self.maps = MapCatalog()
+        # Pictures for finished games
+        self.assets = AssetCache()
+
+        # Active games from database. The old TinyDB file gets imported once if it is still around.
+        if storage_backend == "journal":
+            self.db = JournalStorage('db')
+        else:
+            self.db = SqliteStorage('db.sqlite3')
+        self.db.import_tinydb('db.json')
+
+        # Lookup tables for games, so searches by code, status, group pass or user don't scan the database
+        self.game_index = GameIndex()
+        # Open games ordered by the time they get purged
+        self.expiry_queue = ExpiryQueue()
+        games = self.db.search_games()
+        self.game_index.load(games)
+        # Open games in the order game lists show them
+        self.activity_index = ActivityIndex()
+        self.activity_index.load(games)
+        # Group passes each user used lately
+        self.group_pass_history = GroupPassHistory()
+        self.group_pass_history.load(games)
+        for entry in games:
+            self.expiry_queue.update(entry.doc_id, self.get_purge_deadline(entry))
+        self.purge_task = None
+
+        # Names and pictures of discord users and servers, shared by everything that renders games
+        self.discord_cache = DiscordObjectCache(self.bot)
+        # Rendered game lists, shared by everyone asking for the same list
+        self.game_list_cache = GameListCache()
+        # What private messages to many users have in common, rendered once per broadcast
+        self.broadcast_cache = BroadcastCache()
+        # User settings and who wants to be notified about which games
+        self.subscriber_index = SubscriberIndex()
+        self.subscriber_index.load(self.db.all_user_configs())
+
+        # Private messages and pinboard refreshes which still have to happen, kept over restarts
+        self.outbox = Outbox('outbox.jsonl')
+
+        # Pinboards by the games they show
+        self.pinboard_index = PinboardIndex()
+        self.pinboard_index.load(self.db.all_pinboards())
+        # Messages posted below each pinboard, to know when a pinboard is buried
+        self.pinboard_activity = PinboardChannelActivity()
+        for pinboard in self.db.all_pinboards():
+            self.pinboard_activity.watch(pinboard.get("pinboards_channel"), pinboard.get("pinboards_message"))
+
+        # Private messages get sent in the background
+        self.dm_queue = DmQueue(self.get_dm_user, self.render_private_message, self.outbox, workers=dm_workers, interval=dm_interval)
+        # Pinboards waiting for a refresh
+        self.pinboard_queue = PinboardRefreshQueue(self.refresh_pinboard, self.outbox, debounce=pinboard_debounce_seconds, concurrency=pinboard_concurrency)
+
+        # Components and modals whose custom_id carries more than their name, by name. See dispatch_component.
+        self.component_handlers = {
+            "game_list_page" : self.game_list_page,
+            "add_new_game" : self.add_new_game,
+            "modal_new_game" : self.modal_new_game,
+            "select_map" : self.select_map,
+            "join_game" : self.fee_join_game,
+            "abandon_game" : self.fee_abandon_game,
+            "reinstate_game" : self.fee_reinstate_game,
+            "game_ongoing" : self.game_ongoing,
+            "game_success" : self.game_success,
+            "game_over" : self.game_over,
+            "join_game_failed" : self.join_game_failed,
+        }
         
         logging.info("FeeCoop loaded!")
 
-    # Checks an embed for a game id
+    # Background work can only start once the bot runs its event loop
+    @interactions.extension_listener(name="on_start")
+    async def start_background_tasks(self):
+        self.db.start_background_tasks()
+        if not self.purge_task:
+            self.purge_task = asyncio.get_event_loop().create_task(self.purge_loop())
+        self.pinboard_queue.start()
+        self.dm_queue.start()
+
+    # interactions only hands a component to the extension_component with exactly its custom_id. Components which carry data
+    # in their custom_id ("<name>:<field>:...") come in here instead and go to the handler for the name before the first ":".
+    # Buttons from before, with only their name as custom_id, end up at the same handler.
+    @interactions.extension_listener(name="on_component")
+    async def dispatch_component(self, ctx):
+        return await self.dispatch_custom_id(ctx)
+
+    # Same for modals
+    @interactions.extension_listener(name="on_modal")
+    async def dispatch_modal(self, ctx):
+        return await self.dispatch_custom_id(ctx)
+
+    async def dispatch_custom_id(self, ctx):
+        handler = self.component_handlers.get(ctx.data.custom_id.split(":")[0])
+        if handler:
+            return await handler(ctx)
+
+    # Every message in a pinboard channel pushes the pinboard further up
+    @interactions.extension_listener(name="on_message_create")
+    async def count_pinboard_channel_messages(self, message: interactions.Message):
+        self.pinboard_activity.message_created(message.channel_id, message.id)
+
+    # Checks an embed for a game id. Only needed for buttons from before they carried their game in the custom_id.
     async def get_doc_id_from_message(self, ctx, status="open"):
         if not ctx.message.embeds:
             return None
         code = ctx.message.embeds[0].title.split()[0]
-        game_search_fragment = {"code" : code, "status" : status}
-        GamesQ = Query()
-        games = self.db.search(GamesQ.fragment(game_search_fragment))
-        if (not games) or len(games) == 0:
+        doc_ids = self.game_index.find_by_code(code, status=status)
+        if not doc_ids:
             return None
         else:
             # We *should* have only one open game with the same game code
-            return games[0].doc_id
+            return doc_ids[0]
+
+    # Buttons of a game carry its doc_id and version: "<name>:<doc_id>:<version>", both base 36
+    def build_game_custom_id(self, name, entry):
+        return encode_custom_id(name, to_base36(entry.doc_id), to_base36(entry.version))
+
+    # The game a button was made for, with a single lookup. Returns the game or None, and whether the game was changed since the button was made.
+    # Buttons from before only have their name, their game is searched by the code in the message title like it used to be.
+    async def get_game_from_component(self, ctx, status="open"):
+        fields = decode_custom_id(ctx.data.custom_id, 2)
+        if len(fields) < 2:
+            doc_id = await self.get_doc_id_from_message(ctx, status=status)
+            if not doc_id:
+                return None, False
+            return self.db.get_game(doc_id), False
+        entry = self.db.get_game(from_base36(fields[0]))
+        if entry is None:
+            return None, False
+        return entry, entry.version != from_base36(fields[1])
+
+    # Abandoning, reinstating and deletion votes act on the game as the message showed it. Once the game changed, for example
+    # abandoned and reinstated again, the click is refused and the user gets the game as it is now, with fresh buttons.
+    async def send_outdated_game(self, ctx, entry):
+        embed = await self.build_embed_for_game(doc_id=entry.doc_id, show_private_information=True, for_server=ctx.guild_id, entry=entry)
+        components = await self.build_components_for_game(doc_id=entry.doc_id, for_user=ctx.user, entry=entry)
+        return await ctx.send("The game " + entry.code + " changed since this message was made. This is how it looks now, please try again.", embeds=[embed], components=components, ephemeral=True)
+
+    # Answer for a button whose game is gone or not in the status the button was made for
+    def game_not_found_message(self, entry, changed, message):
+        if entry and changed:
+            return "This message is outdated, the game " + entry.code + " is " + entry.status + " by now."
+        return message
+
+    # All game writes go through these two functions, so the in-memory indexes stay in sync with the database
+    def store_new_game(self, new_item):
+        doc_id = self.db.insert_game(new_item)
+        entry = self.db.get_game(doc_id)
+        self.game_changed(entry)
+        return doc_id
+
+    def store_game_changes(self, doc_id, fields=None, add_turn=None, add_deletion_vote=None):
+        self.db.update_game(doc_id, fields, add_turn=add_turn, add_deletion_vote=add_deletion_vote)
+        entry = self.db.get_game(doc_id)
+        self.game_changed(entry)
+
+    def game_changed(self, entry):
+        # Game lists which showed the game before or show it now have to be rendered again
+        old_game = None
+        if entry.doc_id in self.game_index.indexed:
+            code, old_status, old_group_pass, old_users = self.game_index.indexed[entry.doc_id]
+            old_game = GameSummary(status=old_status, group_pass=old_group_pass, server_only=entry.server_only, host_server=entry.host_server, users=old_users)
+        new_game = GameSummary(status=entry.status, group_pass=entry.group_pass, server_only=entry.server_only, host_server=entry.host_server, users=entry.participants)
+        self.game_list_cache.invalidate_game(old_game, new_game)
+        self.broadcast_cache.invalidate_game(entry.doc_id)
+
+        self.game_index.update(entry)
+        self.activity_index.update(entry)
+        self.group_pass_history.update(entry)
+        self.expiry_queue.update(entry.doc_id, self.get_purge_deadline(entry))
+
+    # Same for pinboards, so the pinboard index stays in sync
+    def store_new_pinboard(self, new_entry):
+        doc_id = self.db.insert_pinboard(new_entry)
+        self.pinboard_index.update(self.db.get_pinboard(doc_id))
+        return doc_id
+
+    def remove_pinboard(self, doc_id):
+        pinboard = self.db.get_pinboard(doc_id)
+        self.db.remove_pinboard(doc_id)
+        self.pinboard_index.remove(doc_id)
+        if pinboard:
+            self.pinboard_activity.forget(pinboard.get("pinboards_channel"))
 
-    # Gets a random image from the directory and returns it
-    async def get_finished_picture(self, status="success"):
-        img_directory = "ressources/" + status 
-        files = os.listdir(img_directory)
-        random_file = random.choice(files)
-        absolute_path = os.path.abspath(os.path.join(img_directory, random_file))
-        return absolute_path, random_file
+    # Open games get purged some time after the last turn. Other games never. In microseconds, like all timestamps.
+    def get_purge_deadline(self, entry):
+        if entry.status != "open" or not entry.turns:
+            return None
+        return entry.last_activity + timedelta_to_micros(purge_after)
+
+    # Users we want to send private messages to. Sending needs the full user object, names and avatars come from self.discord_cache.
+    async def get_dm_user(self, user_id):
+        userobj = await interactions.get(self.bot, interactions.User, object_id=user_id)
+        userobj._client = self.client._http
+        return userobj
+
+    # Renders a private message of the DM queue right before it is sent, so it shows the game as it is by then
+    async def render_private_message(self, message, user_obj):
+        if message.kind == "new_game":
+            # The embed is the same for every subscriber, only the buttons differ
+            broadcast_key = ("new_game", message.doc_id, message.extra.get("server_id"))
+            shared = self.broadcast_cache.get(broadcast_key)
+            if shared is None:
+                embed = await self.build_embed_for_game(doc_id=message.doc_id, show_private_information=False, for_server=None)
+                description_server_name = ""
+                if message.extra.get("server_id"):
+                    server_obj = await self.discord_cache.get_guild(message.extra["server_id"])
+                    description_server_name = " on server " + server_obj.name
+                embed.description = "A new game has been created" + description_server_name + "! You get this message because you turned **notifications on**. To deactivate notifications, reply with using this command:\n\n``/fee notifications``\n\n\n" + embed.description
+                embed.description = embed.description[0:4096]
+                shared = (embed, self.db.get_game(message.doc_id))
+                self.broadcast_cache.put(broadcast_key, shared)
+            embed, entry = shared
+            components = await self.build_components_for_game(doc_id=message.doc_id, for_user=user_obj, entry=entry)
+            return {"embeds" : [embed], "components" : components}
+        elif message.kind == "game_finished":
+            # Same embed for every participant
+            broadcast_key = ("game_finished", message.doc_id, message.extra["picture_name"])
+            embed = self.broadcast_cache.get(broadcast_key)
+            if embed is None:
+                embed, files = await self.build_finished_game_message(message.doc_id, message.extra["status"], message.extra["picture_name"])
+                if files:
+                    # No upload to link to, so this one carries the picture itself
+                    return {"embeds" : [embed], "files" : files}
+                self.broadcast_cache.put(broadcast_key, embed)
+            return {"embeds" : [embed]}
+        elif message.kind == "game_purged":
+            # Build an embed for the host to reinstate the game if needed
+            embed = await self.build_embed_for_game(doc_id=message.doc_id, show_private_information=True, for_server=None)
+            embed.description = "This game has been **abandoned** automatically because it has been inactive for a while now so it likely has already been finished. If you want to list the game as open game again, just click the button below to **reinstate** it.\n\n\n" + embed.description
+            embed.description = embed.description[0:4096]
+            # Host gets the "create new game" button
+            components = await self.build_components_for_game(doc_id=message.doc_id, for_user=user_obj)
+            return {"embeds" : [embed], "components" : components}
+        elif message.kind == "game_deleted":
+            embed, components = await self.build_deleted_game_message(message.doc_id, message.extra["deletion_votes"], user_obj)
+            return {"embeds" : [embed], "components" : components}
+        logging.info("render_private_message: Unknown kind of message " + message.kind)
+        return None
+
+    # Embed shown to everyone when a game is finished, and the files to send with it.
+    # If the picture was uploaded a short while ago, the embed links to that upload and there are no files to send.
+    async def build_finished_game_message(self, doc_id, status, picture_name):
+        embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=None)
+        uploaded_url = self.assets.uploaded_url(picture_name)
+        if uploaded_url:
+            embed.set_image(url=uploaded_url)
+            return embed, None
+        embed.set_image(url="attachment://" + picture_name)
+        return embed, [self.assets.picture_file(status, picture_name)]
+
+    # Runs in the background and purges old games exactly when they are due. Sleeps until the next deadline or until an earlier one gets added.
+    async def purge_loop(self):
+        while True:
+            self.expiry_queue.wakeup.clear()
+            next_deadline = self.expiry_queue.next_deadline()
+            timeout = None
+            if next_deadline:
+                timeout = max(0, (next_deadline - now_micros()) / 1000000)
+            try:
+                await asyncio.wait_for(self.expiry_queue.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.purge_old_entries()
+            except Exception as e:
+                logging.info("Purge_loop: Purging failed, " + str(e))
 
     # Check for old games and delete them
     async def purge_old_entries(self):
-        # Search for open games only
-        game_search_fragment = {"status" : "open"}
-        GamesQ = Query()
-        games = self.db.search(GamesQ.fragment(game_search_fragment))
+        # Only the open games which are due
+        games = self.db.get_games(self.expiry_queue.pop_due(now_micros()))
 
-        # Instead of a fancy TinyDB search we manually select now the entries which are too old
         for entry in games:
-            turns = entry.get("turns", [])
-            last_activity = turns[-1]["timestamp"]
-            timestamp = datetime.datetime.fromisoformat(last_activity)
-            days_since_last_activity = (datetime.datetime.utcnow() - timestamp).days
+            days_since_last_activity = (now_micros() - entry.last_activity) // MICROS_PER_DAY
 
             # Older than 2 days? Remove and tell the owner that he can add it again anytime
-            if days_since_last_activity > 2:
+            if entry.status == "open" and days_since_last_activity > 2:
                 logging.info("Purge_old_entries: Game is " + str(days_since_last_activity) + " days old.")
                 
                 # Update game status
-                self.db.update({"status" : "abandoned"}, doc_ids=[entry.doc_id])
-                # Note: No pinboard update here, because this function gets triggered by the pinboard update, avoid circle loop
-
-                # Build an embed for the host to reinstate the game if needed
-                embed = await self.build_embed_for_game(doc_id=entry.doc_id, show_private_information=True, for_server=None)
-                embed.description = "This game has been **abandoned** automatically because it has been inactive for a while now so it likely has already been finished. If you want to list the game as open game again, just click the button below to **reinstate** it.\n\n\n" + embed.description
-                embed.description = embed.description[0:4096]
+                self.store_game_changes(entry.doc_id, {"status" : "abandoned"})
+                # Purging runs on its own now, so it can update the pinboards without going in circles
+                self.update_pinboards(game_wants_server_only=entry.server_only, server_id=entry.host_server, group_pass=entry.group_pass)
 
-                # Get the host object to send a private message
-                started_userid = turns[0]["user"]
-                started_userobj = await interactions.get(self.bot, interactions.User, object_id=started_userid)
-                started_userobj._client = self.client._http
-
-                # Host gets the "create new game" button
-                components = await self.build_components_for_game(doc_id=entry.doc_id, for_user=started_userobj)
-                logging.info("Purge_old_entries: Sending private message to " +  started_userobj.username + "#" + started_userobj.discriminator)
-                try:
-                    await started_userobj.send(embeds=[embed], components=components)
-                except interactions.api.LibraryException as e:
-                    logging.info("Purge_old_entries: Failed to send private message," + str(e))
-                    
+                # Tell the host, who can reinstate the game if needed
+                self.dm_queue.send("game_purged", entry.doc_id, entry.host_user)
+            else:
+                # Not due after all, put it back with its current deadline
+                self.expiry_queue.update(entry.doc_id, self.get_purge_deadline(entry))
 
     # Shows the current game list in the channel
     async def show_game_list(self, ctx, server_only=None, group_pass="", status="open", mygames=None, ephemeral=False, pinboard=False):
@@ -121,11 +355,8 @@ class FeeCoop(interactions.Extension):
         embed, components = await self.build_game_list(userobj=ctx.user, server_id=server_id, server_only=server_only, group_pass=group_pass, status=status, mygames=mygames, pinboard=pinboard)
         return await ctx.send(embeds=[embed], components=components, ephemeral=ephemeral)
 
-    # Lists all games with given criteria
-    async def build_game_list(self, userobj=None, server_id="", server_only=None, group_pass="", status="open", mygames=None, pinboard=False):
-        # Before we attempt to create any kind of list, we should purge the list from old entries.
-        await self.purge_old_entries()
-        
+    # Lists all games with given criteria, one page at a time. after and backwards pick the page, see GameListKey.
+    async def build_game_list(self, userobj=None, server_id="", server_only=None, group_pass="", status="open", mygames=None, pinboard=False, after=None, backwards=False):
         if pinboard:
             color = interactions.Color.white()
         else:
@@ -138,8 +369,19 @@ class FeeCoop(interactions.Extension):
         if not server_id:
             server_only = False
 
+        # The games and most of their text are the same for everyone asking with the same criteria, so they are cached
+        participant = None
+        if mygames and userobj:
+            participant = str(userobj.id)
+        key = GameListKey(status=status or None, group_pass=group_pass or "", server_only=bool(server_only), server_id=str(server_id or ""), mygames=bool(mygames), participant=participant, after=after, backwards=bool(backwards))
+        rendered_games, more = await self.get_game_list_page(key)
+        if not rendered_games and key.after is not None:
+            # The games around the page are gone meanwhile, start over
+            key = key._replace(after=None, backwards=False)
+            rendered_games, more = await self.get_game_list_page(key)
+
         if server_only:
-            serverobj = await interactions.get(self.bot, interactions.Guild, object_id=server_id)
+            serverobj = await self.discord_cache.get_guild(server_id)
             embed.set_author(name="Only listing server: " + serverobj.name, icon_url=serverobj.icon_url)
         elif group_pass:
             embed.set_author(name="Open games from all servers with group pass: " + group_pass)
@@ -150,117 +392,39 @@ class FeeCoop(interactions.Extension):
         if pinboard:
             embed.set_footer(text="Pinboard auto-refresh: On", icon_url="https://cdn.discordapp.com/emojis/1072284456146190346.gif")
 
-        # Prepare a simple search for these criteria
-        game_search_fragment = {}
-        if status:
-            game_search_fragment["status"] = status
-        if group_pass:
-            game_search_fragment["group_pass"] = group_pass
-        else:
-            # These games explicitly do not want to be listed
-            if not mygames:
-                game_search_fragment["group_pass"] = ""
-
-        # Do we have any subcriteria where we need to check the individual turns?
-        GamesQ = Query()
-        if server_only:
-            # EVERY Turn object must have the same server ID as the current server
-            logging.info("build_game_list: Searching for current server and " + str(game_search_fragment))
-            TurnsQ = Query()
-            games = self.db.search((GamesQ.fragment(game_search_fragment)) & (GamesQ.turns.all(TurnsQ.server == server_id)))
-        elif mygames and userobj:
-            # The current user must be present in ANY turn, not neccessarily in all turns
-            logging.info("build_game_list: Searching for current user and " + str(game_search_fragment))
-            TurnsQ = Query()
-            games = self.db.search((GamesQ.fragment(game_search_fragment)) & (GamesQ.turns.any(TurnsQ.user == str(userobj.id))))
-        else:
-            # Just match the broad search from above
-            logging.info("build_game_list: Searching for " + str(game_search_fragment))
-            games = self.db.search(GamesQ.fragment(game_search_fragment))
-
-        # Sort the dict by timestamp and go
-        def sort_by_timestamp(game):
-            turns = game['turns']
-            if turns:
-                last_activity = turns[-1]['timestamp']
-                timestamp = datetime.datetime.fromisoformat(last_activity)
-                return timestamp
-            else:
-                return datetime.datetime.max
-
-        reverse_sort = False
-        if mygames:
-            reverse_sort = True
-        sorted_games = sorted(games, key=sort_by_timestamp,reverse=reverse_sort)
         description = ""
         options = []
-        for entry in sorted_games:
-            turns = entry.get("turns", [])
-            # Some games don't want to be seen unless they are on a specific server.
-            game_wants_server_only = entry.get("server_only")
-            if game_wants_server_only:
-                game_server_id = turns[0]["server"]
-                if server_id != game_server_id:
-                    continue
-            
-            # First line: Code and map
-            code = entry["code"]
-            if not status:
-                # If no status was selected, show the current games status
-                code += " (" + entry.get("status") + ")"
-            if mygames and entry.get("group_pass"):
-                code += " (group pass locked)"
+        shown_games = []
+        for rendered_game in rendered_games:
+            code = rendered_game.label
             # If the current user played it already, mark the game
             if userobj and (not mygames) and (not pinboard):
-                user_is_participant, user_is_host = await self.is_user_in_game(doc_id=entry.doc_id, user=userobj)
-                if user_is_participant:
+                if str(userobj.id) in rendered_game.users:
                     code += " (already joined)"
-
-            map = entry.get("map")
-            difficulty = self.mapdata[map]["difficulty"]
-            mapname = self.mapdata[map]["name"]
-            maxplayers = self.mapdata[map]["maxplayers"]
-            try: 
-                mapemoji = self.emoji["map" + str(map)]
-            except:
-                mapemoji = ""
-            description += "**" + code + "** - " + mapemoji + " " + mapname + "(" + difficulty + ")\n"
-
-            # Second line: User, timestamp and turn count
-            created_on = turns[0]["timestamp"]
-            last_activity = turns[len(turns) - 1]["timestamp"]
-            started_userid = turns[0]["user"]
-            started_serverid = turns[0]["server"]
-            started_userobj = await interactions.get(self.bot, interactions.User, object_id=started_userid)
-            if started_serverid:
-                started_serverobj = await interactions.get(self.bot, interactions.Guild, object_id=started_serverid)
-            timestamp = datetime.datetime.fromisoformat(last_activity)
-            utc_time = calendar.timegm(timestamp.utctimetuple())
-            last_activity_discordstring = "<t:" + str(utc_time) + ":R>"
-            username = started_userobj.username + "#" + started_userobj.discriminator
-            if started_serverid and (started_serverid != server_id):
-                username += " (server " + started_serverobj.name + ")"
-            description += "*by user " + username + ", " + str(len(turns)) +  "/" + str(maxplayers) + " players, " + last_activity_discordstring + "*\n\n"
-
-            # Now prepare the select menu. For this we need the emoji as emoji object, not as string
-            if len(options) < 25:
-                start = mapemoji.find(":", mapemoji.find(":") + 1) + 1
-                end = mapemoji.find(">")
-                emoji_id = mapemoji[start:end]
-                emoji = interactions.Emoji(id=emoji_id)
-                options.append(SelectOption(label=code, 
-                                                value=entry.doc_id, 
-                                                description=str(mapname + " by " + username)[:100],
-                                                emoji=emoji
-                                                )
-                                            )
-
-            # Max length
-            if len(description) >= 4096:
-                description = description[0:4096]
+            # Second line: User, timestamp and turn count. The host server is only named on other servers.
+            username = rendered_game.host_name
+            if rendered_game.host_server and rendered_game.host_server != key.server_id:
+                username += rendered_game.server_name
+            game_description = "**" + code + "**" + rendered_game.first_line + "*by user " + username + rendered_game.players_line
+
+            # Max length. Games which don't fit anymore start the next page.
+            if len(description) + len(game_description) > 4096:
                 break
+            description += game_description
+            shown_games.append(rendered_game)
+
+            # Now prepare the select menu
+            options.append(SelectOption(label=code, 
+                                            value=rendered_game.doc_id, 
+                                            description=str(rendered_game.map_name + " by " + username)[:100],
+                                            emoji=rendered_game.emoji
+                                            )
+                                        )
         if not description:
             description = "No games found!"
+        if debug_mode:
+            logging.info(self.discord_cache.stats())
+            logging.info(self.game_list_cache.stats())
 
         embed.description = description
         
@@ -276,24 +440,245 @@ class FeeCoop(interactions.Extension):
                 )
             components = [[s1]]
 
+        # Buttons to the pages before and after this one
+        if key.backwards:
+            has_previous = more
+            has_next = True
+        else:
+            has_previous = key.after is not None
+            has_next = more or len(shown_games) < len(rendered_games)
+        b_previous = None
+        b_next = None
+        if has_previous and shown_games:
+            b_previous = self.build_page_button(key, "p", shown_games[0].position)
+        if has_next and shown_games:
+            b_next = self.build_page_button(key, "n", shown_games[-1].position)
+
         # Add a new game button
         # if pinboard:
-        b1 = Button(style=3, custom_id="add_new_game", label="Add new game", emoji=interactions.Emoji(name="🆕"))
+        # The button tells the new game if it is only for this server or which group pass it has. Group pass beats server ID, but stored are only 20 characters of it.
+        new_game_group_pass = ""
+        if not key.server_only:
+            new_game_group_pass = key.group_pass[0:20]
+        b1 = Button(style=3, custom_id=encode_custom_id("add_new_game", int(key.server_only), new_game_group_pass), label="Add new game", emoji=interactions.Emoji(name="🆕"))
         components = [[b1]]
 
         # If multiple components, make them pretts
-        if s1 and b1:
-            components = spread_to_rows(s1, b1)
+        all_components = [component for component in [s1, b_previous, b_next, b1] if component]
+        if len(all_components) > 1:
+            components = spread_to_rows(*all_components)
 
         return embed, components
 
+    # A page of a game list and whether there are more games behind it. Lists of all servers look the same on every server,
+    # except for the games which want to stay on their server. So the games of all servers are rendered once for every server,
+    # and only the games staying on this server are rendered per server and merged in.
+    async def get_game_list_page(self, key):
+        if key.server_only or not key.server_id:
+            return await self.get_game_page(key)
+        public_games, public_more = await self.get_game_page(key._replace(server_id=""))
+        server_games, server_more = await self.get_game_page(key._replace(server_games=True))
+        if not server_games:
+            return public_games, public_more
+        rendered_games = sorted(public_games + server_games, key=lambda rendered_game: rendered_game.position, reverse=key.mygames)
+        more = public_more or server_more or len(rendered_games) > games_per_page
+        if key.backwards:
+            # The games closest to the page after are at the end
+            rendered_games = rendered_games[-games_per_page:]
+        else:
+            rendered_games = rendered_games[:games_per_page]
+        return rendered_games, more
+
+    # A rendered page of a game list and whether there are more games behind it, from the cache if possible
+    async def get_game_page(self, key):
+        page = self.game_list_cache.get(key)
+        if page is None:
+            generation = self.game_list_cache.generation
+            page = await self.render_game_page(key)
+            self.game_list_cache.put(key, page, generation)
+        return page
+
+    # Button to the next ("n") or previous ("p") page of a game list. The criteria and the game the page starts behind are in the custom_id.
+    # None if the group pass is too long for a custom_id. Such a group pass finds no games anyway, new games keep only 20 characters of it.
+    def build_page_button(self, key, direction, position):
+        flags = int(key.server_only) + 2 * int(key.mygames)
+        custom_id = encode_custom_id("game_list_page", direction, key.status or "", flags, to_base36(position[0]), to_base36(position[1]), key.group_pass)
+        if not custom_id:
+            return None
+        if direction == "p":
+            return Button(style=2, custom_id=custom_id, label="Previous", emoji=interactions.Emoji(name="◀️"))
+        return Button(style=2, custom_id=custom_id, label="Next", emoji=interactions.Emoji(name="▶️"))
+
+    # Next and previous buttons of game lists. Ephemeral lists turn the page in place,
+    # for pinboards and other public lists the clicking user gets the page as a new ephemeral message.
+    async def game_list_page(self, ctx):
+        direction, status, flags, last_activity, doc_id, group_pass = decode_custom_id(ctx.data.custom_id, 6)
+        flags = from_base36(flags)
+        server_only = bool(flags & 1)
+        mygames = bool(flags & 2)
+        server_id = ""
+        if ctx.guild_id:
+            server_id = str(ctx.guild_id)
+        in_place = bool(ctx.message and ctx.message.flags == 64)
+        if in_place:
+            await ctx.defer(edit_origin=True)
+        else:
+            await ctx.defer(ephemeral=True)
+        embed, components = await self.build_game_list(userobj=ctx.user, server_id=server_id, server_only=server_only, group_pass=group_pass, status=status, mygames=mygames,
+                                                       after=(from_base36(last_activity), from_base36(doc_id)), backwards=(direction == "p"))
+        if in_place:
+            return await ctx.edit(embeds=[embed], components=components)
+        return await ctx.send(embeds=[embed], components=components, ephemeral=True)
+
+    # Open games matching the criteria of GameIndex.search, ordered by last activity, starting behind the position after. Yields the games one by one.
+    # Games are fetched from the storage a batch at a time, so a list which stops early never loads the rest.
+    # Lists of one group pass walk only the games with it. host_server: Only the games hosted on this server.
+    # server_only_host: Only the games which want to stay on this server.
+    def walk_open_games(self, criteria, reverse=False, after=None, batch_size=games_per_page, host_server=None, server_only_host=None):
+        if criteria.get("participant") is not None:
+            # The games of one user are few, sorting them is cheaper than walking all open games
+            walk = self.activity_index.order(self.game_index.search(**criteria), reverse=reverse, after=after, host_server=host_server, server_only_host=server_only_host)
+        else:
+            walk = self.activity_index.walk(reverse=reverse, after=after, group_pass=criteria.get("group_pass"), host_server=host_server, server_only_host=server_only_host)
+        doc_ids = (doc_id for doc_id in walk if self.game_index.matches(doc_id, **criteria))
+        while True:
+            batch = list(itertools.islice(doc_ids, batch_size))
+            if not batch:
+                return
+            games = {game.doc_id : game for game in self.db.get_games(batch)}
+            for doc_id in batch:
+                if doc_id in games:
+                    yield games[doc_id]
+
+    # Searches and renders the games for one page of a game list. Only the parts which are the same for everyone, see build_game_list.
+    # Returns the rendered games and whether there are more games behind the page.
+    async def render_game_page(self, key):
+        # Prepare a simple search for these criteria
+        game_search_fragment = {}
+        if key.status:
+            game_search_fragment["status"] = key.status
+        if key.group_pass:
+            game_search_fragment["group_pass"] = key.group_pass
+        else:
+            # These games explicitly do not want to be listed
+            if not key.mygames:
+                game_search_fragment["group_pass"] = ""
+
+        # The current user must be present in ANY turn, not neccessarily in all turns
+        if key.participant:
+            game_search_fragment["participant"] = key.participant
+
+        # Oldest games first, but your own games newest first. The page before a position is found by walking the other way round.
+        reverse_sort = bool(key.mygames) != bool(key.backwards)
+
+        # Where a game is in the list
+        def list_position(game):
+            return (game.last_activity or 0, game.doc_id)
+
+        if key.status == "open":
+            # Open games come from the activity index already in order, and only as many as the page needs
+            logging.info("render_game_page: Walking open games for " + str(game_search_fragment) + " after " + str(key.after))
+            # Games with all turns on this server were hosted here too
+            host_server = None
+            if key.server_only:
+                host_server = key.server_id
+            server_only_host = None
+            if key.server_games:
+                server_only_host = key.server_id
+            sorted_games = self.walk_open_games(game_search_fragment, reverse=reverse_sort, after=key.after, batch_size=games_per_page + 1, host_server=host_server, server_only_host=server_only_host)
+        else:
+            logging.info("render_game_page: Searching for " + str(game_search_fragment) + " after " + str(key.after))
+            games = self.db.get_games(self.game_index.search(**game_search_fragment))
+
+            # Sort the games by their last activity and go
+            sorted_games = sorted(games, key=list_position, reverse=reverse_sort)
+            if key.after is not None:
+                if reverse_sort:
+                    sorted_games = [game for game in sorted_games if list_position(game) < key.after]
+                else:
+                    sorted_games = [game for game in sorted_games if list_position(game) > key.after]
+
+        # Some games don't want to be seen unless they are on a specific server.
+        visible_games = []
+        for entry in sorted_games:
+            # EVERY Turn object must have the same server ID as the current server
+            if key.server_only and not all(turn.server == key.server_id for turn in entry.turns):
+                continue
+            game_wants_server_only = entry.server_only
+            if key.server_games and not game_wants_server_only:
+                continue
+            if game_wants_server_only:
+                game_server_id = entry.host_server
+                if key.server_id != game_server_id:
+                    continue
+            visible_games.append(entry)
+            # One game more than the page shows tells if there is another page
+            if len(visible_games) > games_per_page:
+                break
+        more = len(visible_games) > games_per_page
+        visible_games = visible_games[:games_per_page]
+        if key.backwards:
+            # Walked backwards from the page after, but shown in the usual order
+            visible_games.reverse()
+
+        # Get all hosts and their servers from discord at the same time, then render from the cache
+        await self.discord_cache.prefetch(user_ids=[entry.host_user for entry in visible_games], guild_ids=[entry.host_server for entry in visible_games])
+
+        rendered_games = []
+        for entry in visible_games:
+            # First line: Code and map
+            code = entry.code
+            if not key.status:
+                # If no status was selected, show the current games status
+                code += " (" + entry.status + ")"
+            if key.mygames and entry.group_pass:
+                code += " (group pass locked)"
+
+            map_info = self.maps.get(entry.map)
+            first_line = " - " + map_info.emoji_string + " " + map_info.label + "\n"
+
+            # Second line: User, timestamp and turn count. Whether the host server is named depends on where the list is shown, see build_game_list.
+            started_userid = entry.host_user
+            started_serverid = entry.host_server
+            started_userobj = await self.discord_cache.get_user(started_userid)
+            server_name = ""
+            if started_serverid:
+                started_serverobj = await self.discord_cache.get_guild(started_serverid)
+                server_name = " (server " + started_serverobj.name + ")"
+            last_activity_discordstring = "<t:" + str(micros_to_unix(entry.last_activity)) + ":R>"
+            players_line = ", " + str(len(entry.turns)) +  "/" + str(map_info.maxplayers) + " players, " + last_activity_discordstring + "*\n\n"
+
+            rendered_games.append(RenderedGame(doc_id=entry.doc_id,
+                                               label=code,
+                                               first_line=first_line,
+                                               host_name=started_userobj.username + "#" + started_userobj.discriminator,
+                                               host_server=started_serverid,
+                                               server_name=server_name,
+                                               players_line=players_line,
+                                               map_name=map_info.name,
+                                               emoji=map_info.emoji,
+                                               users=entry.participants,
+                                               position=list_position(entry)))
+        return rendered_games, more
+
     # Button to add a new game. Needs to ask for the game ID.
-    @interactions.extension_component("add_new_game")
     async def add_new_game(self, ctx):
-        # Prepare a popup window
+        fields = decode_custom_id(ctx.data.custom_id, 2)
+        if len(fields) < 2:
+            # Buttons from before carried nothing, but the list above them tells in its author line. Pinboards keep such buttons until their next refresh.
+            author = ""
+            if ctx.message.embeds and ctx.message.embeds[0].author:
+                author = ctx.message.embeds[0].author.name
+            fields = [0, ""]
+            if "Only listing server" in author:
+                fields = [1, ""]
+            elif "Open games from all servers with group pass: " in author:
+                fields = [0, author.replace("Open games from all servers with group pass: ","")[0:20]]
+
+        # Prepare a popup window. It hands server only and group pass on to modal_new_game.
         modal = interactions.Modal(
             title="Enter Relay Trials code",
-            custom_id="modal_new_game",
+            custom_id=encode_custom_id("modal_new_game", *fields),
             components=[interactions.TextInput(
                             style=interactions.TextStyleType.SHORT,
                             label="Relay Trials coop code",
@@ -307,48 +692,39 @@ class FeeCoop(interactions.Extension):
                 )   
         await ctx.popup(modal)
 
-    # Now we have filename, speaker and input text. Update file if needed
-    @interactions.extension_modal("modal_new_game")
-    async def modal_new_game(self, ctx, code: str):
-        group_pass = ""
-        server_only = False
-        author = ""
-        if ctx.message.embeds[0].author:
-            author = ctx.message.embeds[0].author.name
-        if "Only listing server" in author:
-            server_only = True
-        if "Open games from all servers with group pass: " in author:
-            group_pass = author.replace("Open games from all servers with group pass: ","")
+    # Now we have the code. Server only and group pass come with the custom_id of the modal.
+    async def modal_new_game(self, ctx):
+        code = ctx.data.components[0].components[0].value
+        server_only, group_pass = decode_custom_id(ctx.data.custom_id, 2)
+        server_only = bool(from_base36(server_only) & 1)
         logging.info("Adding new game via modal_new_game by user " + ctx.user.username + "#" + ctx.user.discriminator + " Code: " + code + " Server_only: " + str(server_only) + " group pass: " + group_pass)
         return await self.show_or_create_game(ctx=ctx, code=code, server_only=server_only, group_pass=group_pass, ephemeral=True)
 
     # Is the user part of this game? Expects a doc_id and a ctx.user object
-    async def is_user_in_game(self, doc_id, user):
-        entry = self.db.get(doc_id=doc_id)
-        turns = entry.get("turns", [])
+    async def is_user_in_game(self, doc_id, user, entry=None):
+        if entry is None:
+            entry = self.db.get_game(doc_id)
         user_is_participant = False
         user_is_host = False
-        if str(user.id) in [turn['user'] for turn in turns]:
+        if str(user.id) in entry.participants:
             user_is_participant = True
-            if (str(user.id) == turns[0]['user']):
+            if (str(user.id) == entry.host_user):
                 user_is_host = True
         return user_is_participant, user_is_host
 
     # Can the user delete this game? Excpets a doc_id and a ctx.user object
-    async def can_user_delete_game(self, doc_id, user):
-        entry = self.db.get(doc_id=doc_id)
-        status = entry.get("status")
+    async def can_user_delete_game(self, doc_id, user, entry=None):
+        if entry is None:
+            entry = self.db.get_game(doc_id)
+        status = entry.status
         if status != "open":
             return False
         
         # When was the game touched the last time?
-        turns = entry.get("turns", [])
-        last_activity = turns[-1]["timestamp"]
-        timestamp = datetime.datetime.fromisoformat(last_activity)
-        days_since_last_activity = (datetime.datetime.now() - timestamp).days
+        days_since_last_activity = (now_micros() - entry.last_activity) // MICROS_PER_DAY
 
         # User owner or participant?
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=user)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=user, entry=entry)
 
         # Allow to abandon the game? Host can abandon always, participants after one day
         if user_is_host or (user_is_participant and days_since_last_activity > 1):
@@ -360,48 +736,46 @@ class FeeCoop(interactions.Extension):
         return False
 
     # Determines which buttons the user can see and returns them. Parameter for_user expects a ctx.user object or nothing.
-    async def build_components_for_game(self, doc_id, for_user=None):
+    # If the game is at hand already, it can be passed as entry.
+    async def build_components_for_game(self, doc_id, for_user=None, entry=None):
         components = None
         # Join - If the game is open and user didnt join already. Opens new modal with finished, lost and couldnt join
         # Abandon - If user is part of the group and game is old
         # Reinstate - Hosts can revive abandoned games
 
-        entry = self.db.get(doc_id=doc_id)
-        status = entry.get("status")
-        turns = entry.get("turns", [])
+        if entry is None:
+            entry = self.db.get_game(doc_id)
+        status = entry.status
 
         # Abandoned games can be reinstated by the host
         if status == "abandoned":
-            if for_user and (str(for_user.id) == turns[0]["user"]):
+            if for_user and (str(for_user.id) == entry.host_user):
                 # Is the game ID still free?
-                code = entry.get("code")
-                game_search_fragment = {"code" : code, "status" : "open"}
-                GamesQ = Query()
-                games = self.db.search(GamesQ.fragment(game_search_fragment))
-                if (not games) or len(games) == 0:
+                code = entry.code
+                if not self.game_index.find_by_code(code, status="open"):
                     # No open game with this code exists, host can make one
-                    button_reinstate = Button(style=3, custom_id="reinstate_game", label="Reinstate Game", emoji=interactions.Emoji(name="👼"))
+                    button_reinstate = Button(style=3, custom_id=self.build_game_custom_id("reinstate_game", entry), label="Reinstate Game", emoji=interactions.Emoji(name="👼"))
                     components = [[button_reinstate]]
 
         elif status == "open":
             # Join game - show it always, we only check later if the user is already in the game.
             #if not user_is_participant:
-            button_join = Button(style=3, custom_id="join_game", label="Join", emoji=interactions.Emoji(name="⚔️"))
+            button_join = Button(style=3, custom_id=self.build_game_custom_id("join_game", entry), label="Join", emoji=interactions.Emoji(name="⚔️"))
             button_abandon = None
 
             if for_user:
                 # Old games can be deleted
-                delete_game_allowed = await self.can_user_delete_game(doc_id=doc_id, user=for_user)
+                delete_game_allowed = await self.can_user_delete_game(doc_id=doc_id, user=for_user, entry=entry)
 
                 # Joining is only allowed if user is not in the game already
-                user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=for_user)
+                user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=for_user, entry=entry)
         
                 # Allow to abandon the game? Host can abandon always, participants after one day
                 if delete_game_allowed:
                     if user_is_participant:
-                        button_abandon = Button(style=4, custom_id="abandon_game", label="Remove from open game list", emoji=interactions.Emoji(name="🇽"))
+                        button_abandon = Button(style=4, custom_id=self.build_game_custom_id("abandon_game", entry), label="Remove from open game list", emoji=interactions.Emoji(name="🇽"))
                     else:
-                        button_abandon = Button(style=4, custom_id="abandon_game", label="Abandoned? Remove for EVERYONE", emoji=interactions.Emoji(name="⚠️"))
+                        button_abandon = Button(style=4, custom_id=self.build_game_custom_id("abandon_game", entry), label="Abandoned? Remove for EVERYONE", emoji=interactions.Emoji(name="⚠️"))
 
             # Arrange buttons for discord neatly
             if button_abandon:
@@ -411,22 +785,23 @@ class FeeCoop(interactions.Extension):
         
         return components
 
-    # Makes one embed for each given game ID
-    async def build_embed_for_game(self, doc_id, show_private_information=False, for_server=None):
-        entry = self.db.get(doc_id=doc_id)
-        code = entry["code"]
-        map = entry.get("map")
-        server_only = entry.get("server_only")
-        group_pass = entry.get("group_pass")
-        status = entry.get("status")
-        turns = entry.get("turns", [])
+    # Makes one embed for each given game ID. If the game is at hand already, it can be passed as entry.
+    async def build_embed_for_game(self, doc_id, show_private_information=False, for_server=None, entry=None):
+        if entry is None:
+            entry = self.db.get_game(doc_id)
+        code = entry.code
+        map = entry.map
+        server_only = entry.server_only
+        group_pass = entry.group_pass
+        status = entry.status
+        turns = entry.turns
         if len(turns) > 0:
-            created_on = turns[0]["timestamp"]
-            started_userid = turns[0]["user"]
-            started_serverid = turns[0]["server"]
-            started_userobj = await interactions.get(self.bot, interactions.User, object_id=started_userid)
+            created_on = turns[0].timestamp
+            started_userid = entry.host_user
+            started_serverid = entry.host_server
+            started_userobj = await self.discord_cache.get_user(started_userid)
             if started_serverid:
-                started_serverobj = await interactions.get(self.bot, interactions.Guild, object_id=started_serverid)
+                started_serverobj = await self.discord_cache.get_guild(started_serverid)
             color = assign_color_to_user(started_userobj.username)
         else:
             color = interactions.Color.white()
@@ -443,27 +818,8 @@ class FeeCoop(interactions.Extension):
         except ValueError:
             map = False
         if map:
-            difficulty = self.mapdata[map]["difficulty"]
-            maxturns = self.mapdata[map]["maxturns"]
-            maxplayers = self.mapdata[map]["maxplayers"]
-            possible_rewards = self.mapdata[map]["possible_rewards"]
-            mapname = self.mapdata[map]["name"]
-            # First line: Map
-            try: 
-                mapemoji = self.emoji["map" + str(map)]
-            except:
-                mapemoji = ""
-            embed.description = mapemoji + " " + mapname + "(" + difficulty + ")"
-            # Second line: Turns
-            embed.description += "\nTurns: " + str(maxturns) + " (" + str(maxplayers) + " players)"
-            # Remaining lines: Rewards
-            embed.description += "\nReward:"
-            for reward in possible_rewards:
-                try: 
-                    rewardemoji = self.emoji[reward.lower().split()[0]]
-                except:
-                    rewardemoji = ""
-                embed.description += "\n" + rewardemoji + " " + reward
+            # Map, turns and rewards
+            embed.description = self.maps.get(map).embed_description
 
         if server_only or group_pass:
             # Group pass beats server ID
@@ -477,7 +833,7 @@ class FeeCoop(interactions.Extension):
                 embed.set_footer(text="Only for server: " + started_serverobj.name, icon_url=started_serverobj.icon_url)
 
         if created_on:
-            embed.timestamp=datetime.datetime.fromisoformat(created_on)
+            embed.timestamp=micros_to_datetime(created_on)
 
         if started_userid:
             username = started_userobj.username + "#" + started_userobj.discriminator
@@ -489,17 +845,15 @@ class FeeCoop(interactions.Extension):
 
         if len(turns) > 1:
             for turn in turns[1:]:
-                userid = turn["user"]
-                userobj = await interactions.get(self.bot, interactions.User, object_id=userid)
+                userid = turn.user
+                userobj = await self.discord_cache.get_user(userid)
                 username = userobj.username + "#" + userobj.discriminator
-                serverid = turn["server"]
+                serverid = turn.server
                 # Show if user is on a server, and if that server is a different server than the starting server or if there is no starting server (start via private message)
                 if serverid and ((not started_serverid) or serverid != started_serverid):
-                    serverobj = await interactions.get(self.bot, interactions.Guild, object_id=serverid)
+                    serverobj = await self.discord_cache.get_guild(serverid)
                     username += " (server " + serverobj.name + ")"
-                timestamp = datetime.datetime.fromisoformat(turn["timestamp"])
-                utc_time = calendar.timegm(timestamp.utctimetuple())
-                timestamp_discordstring = "<t:" + str(utc_time) + ":R>"
+                timestamp_discordstring = "<t:" + str(micros_to_unix(turn.timestamp)) + ":R>"
                 embed.add_field(name=username, value=timestamp_discordstring, inline=True)
 
         return embed
@@ -554,7 +908,6 @@ class FeeCoop(interactions.Extension):
             pass
 
         # And now save it in database for automated updates 
-        pinboard_messages = self.db.table("pinboards")
         server_id = ""
         if ctx.guild_id:
             server_id = str(ctx.guild_id)
@@ -565,7 +918,8 @@ class FeeCoop(interactions.Extension):
                         "pinboards_server_id" : server_id,
                         "pinboards_group_pass" : group_pass
                     }
-        pinboard_messages.insert(new_entry)
+        self.store_new_pinboard(new_entry)
+        self.pinboard_activity.watch(channel_id, pinboardmsg.id)
         logging.info("Pinboard on channel: " + ctx.channel.name + " in server " + ctx.guild.name)
         return pinboardmsg
 
@@ -669,9 +1023,7 @@ class FeeCoop(interactions.Extension):
         server_only = True
 
         # Does a setting exist already?
-        user_config = self.db.table("user_config")
-        UserQ = Query()
-        entry = user_config.get(UserQ.user == str(ctx.user.id))
+        entry = self.subscriber_index.get(ctx.user.id)
         doc_id = None
         old_active = False
         old_server_only = False
@@ -699,7 +1051,8 @@ class FeeCoop(interactions.Extension):
         # Deactivate notification
         if not active:
             if old_active:
-                user_config.update({"notifications_active" : False}, doc_ids=[doc_id])
+                self.db.update_user_config(doc_id, {"notifications_active" : False})
+                self.subscriber_index.update(self.db.get_user_config(ctx.user.id))
                 return await ctx.send("All notifictations deactivated!", ephemeral=True)
             else:
                 return await ctx.send("No changes made, notifications were already deactivated for you.", ephemeral=True)
@@ -715,7 +1068,9 @@ class FeeCoop(interactions.Extension):
                             "notifications_server_id" : server_id,
                             "notifications_group_pass" : group_pass
                         }
-            user_config.upsert(new_entry, UserQ.user == str(ctx.user.id))
+            self.db.upsert_user_config(new_entry)
+            self.subscriber_index.update(self.db.get_user_config(ctx.user.id))
+            self.group_pass_history.touch(ctx.user.id, group_pass)
             messagetext = "Notifications"
             if not old_active:
                 messagetext += " activated"
@@ -729,10 +1084,10 @@ class FeeCoop(interactions.Extension):
                     messagetext += ", meaning you will get notifiations from all servers who chose to share them with everyone"
             if server_id != old_server_id and (not group_pass):
                 if ctx.guild_id:
-                    server_obj = await ctx.get_guild()
+                    server_obj = await self.discord_cache.get_guild(ctx.guild_id)
                     messagetext += ". Home server set to " + server_obj.name + ", so games which are only intended for this server will show up for you, too"
                 elif old_server_id:
-                    server_obj = await interactions.get(self.bot, interactions.Guild, object_id=old_server_id)
+                    server_obj = await self.discord_cache.get_guild(old_server_id)
                     messagetext += ". Removed your old home server " + server_obj.name + " so you won't get updates for server-internal games from there anymore"
             if group_pass != old_group_pass:
                 if group_pass:
@@ -746,7 +1101,7 @@ class FeeCoop(interactions.Extension):
     async def notify_users(self, ctx, doc_id, server_only, group_pass):
         
         # Get the game data
-        game_entry = self.db.get(doc_id=doc_id)
+        game_entry = self.db.get_game(doc_id)
         if not game_entry:
             logging.info("notify_users was called with an invalid doc_id " + str(doc_id))
         
@@ -762,132 +1117,117 @@ class FeeCoop(interactions.Extension):
             server_only = False
 
         # Find users who want to get informed
-        user_config = self.db.table("user_config")
-        UserQ = Query()
-        entry = user_config.get(UserQ.user == str(ctx.user.id))
-        user_search_fragment = {}
+        # Also, the users we search for should either ignore server restrictions, or have the exact same server as us
         if server_only:
             # This game is only availible on this server so only look for users on this server
             # This is a workaround. Normally we would get a list of all members on this server and only send the message to them. 
             # But the code is restricted by discord. It would be: members = await server_obj.get_list_of_members()
-            user_search_fragment = {"notifications_active" : True, "notifications_group_pass" : group_pass, "notifications_server_id" : server_id}
+            configs = self.subscriber_index.search(group_pass=group_pass, visible_from_server=server_id, only_server_id=server_id)
         else:
-            user_search_fragment = {"notifications_active" : True, "notifications_group_pass" : group_pass}
-        
-        # Also, the users we search for should either ignore server restrictions, or have the exact same server as us
-        configs = user_config.search(   (UserQ.fragment(user_search_fragment)) 
-                                    & (   
-                                          (UserQ.fragment({"notifications_server_only" : False}))
-                                        | (UserQ.fragment({"notifications_server_id" : server_id}))
-                                    ))
+            configs = self.subscriber_index.search(group_pass=group_pass, visible_from_server=server_id)
+        messages = []
         for config in configs:
             # Send every user a private message
             user_id = config["user"]
             # Except the current user
             if user_id == str(ctx.user.id):
                 continue
-            user_obj = await interactions.get(self.bot, interactions.User, object_id=user_id)
-            user_obj._client = self.client._http
-            logging.info("Informing user " + user_obj.username + "#" + user_obj.discriminator + " about new game " + str(game_entry.get("code")))
-            # Build embed and send it
-            embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=None)
-            description_server_name = ""
-            if ctx.guild_id:
-                server_obj = await ctx.get_guild()
-                description_server_name = " on server " + server_obj.name
-            embed.description = "A new game has been created" + description_server_name + "! You get this message because you turned **notifications on**. To deactivate notifications, reply with using this command:\n\n``/fee notifications``\n\n\n" + embed.description
-            embed.description = embed.description[0:4096]
-            components = await self.build_components_for_game(doc_id=doc_id, for_user=user_obj)
-            logging.info("Notify_users: Sending private message to " + user_obj.username + "#" + user_obj.discriminator)
-            try:
-                return await user_obj.send(embeds=[embed], components=components)
-            except interactions.api.LibraryException as e:
-                logging.info("Notify_users: Failed to send private message, " + str(e))
-                return
+            logging.info("Notify_users: Informing user " + user_id + " about new game " + str(game_entry.code))
+            messages.append(("new_game", doc_id, user_id, {"server_id" : server_id}))
+        self.dm_queue.send_many(messages)
 
-    # Find all pinboards on all servers and update them with new information if needed
-    async def update_pinboards(self, game_wants_server_only=False, server_id="", group_pass=""):
+    # Find all pinboards on all servers which show games like this one and mark them for the next refresh
+    def update_pinboards(self, game_wants_server_only=False, server_id="", group_pass=""):
         if not server_id:
             game_wants_server_only = False
 
         if game_wants_server_only:
             group_pass = ""
             
-        pinboard_messages = self.db.table("pinboards")
-        PinBoardQ = Query()
+        # The servers we search for should either ignore server restrictions, or have the exact same server as us
         if game_wants_server_only:
             # This game is only availible on this server so only update pinboards on this server
-            pinboards_search_fragment = {"pinboards_group_pass" : group_pass, "pinboards_server_id" : server_id}
             logging.info("update_pinboards: Updating pinboards for server only " + server_id)
+            pinboards = self.pinboard_index.search(group_pass=group_pass, visible_from_server=server_id, only_server_id=server_id)
         else:
             # All pinboards on all servers with this group pass. Blank is also a valid group pass as it is the default.
-            pinboards_search_fragment = {"pinboards_group_pass" : group_pass}
             logging.info("update_pinboards: Updating pinboards for group pass: " + group_pass)
+            pinboards = self.pinboard_index.search(group_pass=group_pass, visible_from_server=server_id)
+
+        # The refresh itself happens in the background, so nobody has to wait for it
+        self.pinboard_queue.mark_dirty((doc_id, self.pinboard_index.channel_of(doc_id)) for doc_id in pinboards)
+
+    # Brings one pinboard message up to date with the current games. Returns what was done, for the refresh statistics.
+    async def refresh_pinboard(self, pinboard_doc_id):
+        # The pinboard might have been removed while it waited for its refresh
+        pinboard = self.db.get_pinboard(pinboard_doc_id)
+        if not pinboard:
+            return "removed"
+        logging.info("refresh_pinboard: Found pinboard " + str(pinboard))
+        message_id = pinboard.get("pinboards_message")
+        channel_id = pinboard.get("pinboards_channel")
+        replace_message = True
+        try:
+            message_obj = await interactions.get(self.bot, interactions.Message, object_id=message_id, parent_id=channel_id)
+            channel_obj = await interactions.get(self.bot, interactions.Channel, object_id=channel_id)
+        except interactions.api.LibraryException:
+            # The message doesnt exist anymore, remove from database.
+            logging.info("refresh_pinboard: Pinboard message or channel was deleted, removing from update list.")
+            self.remove_pinboard(pinboard.doc_id)
+            return "removed"
         
-        # Also, the servers we search for should either ignore server restrictions, or have the exact same server as us
-        pinboards = pinboard_messages.search(   (PinBoardQ.fragment(pinboards_search_fragment)) 
-                                                & (   
-                                                    (PinBoardQ.fragment({"pinboards_server_only" : False}))
-                                                    | (PinBoardQ.fragment({"pinboards_server_id" : server_id}))
-                                                ))
-
-        for pinboard in pinboards:
-            logging.info("update_pinboards: Found pinboard " + str(pinboard))
-            message_id = pinboard.get("pinboards_message")
-            channel_id = pinboard.get("pinboards_channel")
-            replace_message = True
-            try:
-                message_obj = await interactions.get(self.bot, interactions.Message, object_id=message_id, parent_id=channel_id)
-                channel_obj = await interactions.get(self.bot, interactions.Channel, object_id=channel_id)
-            except interactions.api.LibraryException:
-                # The message doesnt exist anymore, remove from database.
-                logging.info("update_pinboards: Pinboard message or channel was deleted, removing from update list.")
-                pinboard_messages.remove(doc_ids=[pinboard.doc_id])
-                continue
-            
-            seconds_since_pinboard_posted = (datetime.datetime.now(tz=message_obj.timestamp.tzinfo) - message_obj.timestamp).seconds
-            if seconds_since_pinboard_posted > 28800:
-                logging.info("update_pinboards: Pinboard last active more than 8 hours ago. Reposting it. " + str(message_obj.timestamp))
+        seconds_since_pinboard_posted = (datetime.datetime.now(tz=message_obj.timestamp.tzinfo) - message_obj.timestamp).seconds
+        if seconds_since_pinboard_posted > 28800:
+            logging.info("refresh_pinboard: Pinboard last active more than 8 hours ago. Reposting it. " + str(message_obj.timestamp))
+            replace_message = False
+
+        # Counted from the message events, so no need to ask discord for the channel history
+        if self.pinboard_activity.messages_after(channel_id, message_id) > 2:
+            logging.info("refresh_pinboard: Pinboard is more than 2 messages old. Reposting it. " + str(message_obj.timestamp))
+            replace_message = False
+
+        # Get the parameters of this pinboard
+        server_only = pinboard.get("pinboards_server_only")
+        server_id = pinboard.get("pinboards_server_id")
+        group_pass = pinboard.get("pinboards_group_pass")
+
+        # Now alter the message. Build a new one with exactly the same criteria
+        embed, components = await self.build_game_list(userobj=None, server_id=server_id, server_only=server_only, group_pass=group_pass, status="open", mygames=None, pinboard=True)
+        content_hash = message_content_hash(embed, components)
+        if replace_message:
+            # Editing in the same content again would only use up the rate limit
+            if content_hash == pinboard.get("pinboards_hash"):
+                logging.info("refresh_pinboard: Pinboard unchanged in channel " + str(channel_obj.name))
+                return "unchanged"
+            try: 
+                await message_obj.edit(embeds=[embed], components=components)
+                self.db.update_pinboard(pinboard.doc_id, {"pinboards_hash" : content_hash})
+                logging.info("refresh_pinboard: Pinboard editing successful in channel " + str(channel_obj.name))
+                return "edited"
+            except:
+                # If editing doesnt work, send the message anew
+                logging.info("refresh_pinboard: Pinboard editing was not successful, sending new message in channel " + str(channel_obj.name))
                 replace_message = False
 
-            new_messages_in_channel = channel_obj.history(start_at=message_id, reverse=True, maximum=5)
-            if new_messages_in_channel.object_count > 2:
-                logging.info("update_pinboards: Pinboard is more than 2 messages old. Reposting it. " + str(message_obj.timestamp))
-                replace_message = False
+        # Send a new message if replacing didnt work
+        if not replace_message:
+            logging.info("refresh_pinboard: Sending pinboard as new message in channel " + str(channel_obj.name))
+            pinboardmsg = await channel_obj.send(embeds=[embed], components=components)
+            try:
+                await channel_obj.pin_message(pinboardmsg)
+            except:
+                pass
 
-            # Get the parameters of this pinboard
-            server_only = pinboard.get("pinboards_server_only")
-            server_id = pinboard.get("pinboards_server_id")
-            group_pass = pinboard.get("pinboards_group_pass")
-
-            # Now alter the message. Build a new one with exactly the same criteria
-            embed, components = await self.build_game_list(userobj=None, server_id=server_id, server_only=server_only, group_pass=group_pass, status="open", mygames=None, pinboard=True)
-            if replace_message:
-                try: 
-                    await message_obj.edit(embeds=[embed], components=components)
-                    logging.info("update_pinboards: Pinboard editing successful in channel " + str(channel_obj.name))
-                except:
-                    # If editing doesnt work, send the message anew
-                    logging.info("update_pinboards: Pinboard editing was not successful, sending new message in channel " + str(channel_obj.name))
-                    replace_message = False
-
-            # Send a new message if replacing didnt work
-            if not replace_message:
-                logging.info("update_pinboards: Sending pinboard as new message in channel " + str(channel_obj.name))
-                pinboardmsg = await channel_obj.send(embeds=[embed], components=components)
+            # Update the database with the new message ID
+            self.db.update_pinboard(pinboard.doc_id, {"pinboards_message" : str(pinboardmsg.id), "pinboards_hash" : content_hash})
+            self.pinboard_activity.watch(channel_id, pinboardmsg.id)
+            # At least try cleaning up the old message
+            if message_obj:
                 try:
-                    await channel_obj.pin_message(pinboardmsg)
+                    await message_obj.delete()
                 except:
-                    pass
-
-                # Update the database with the new message ID
-                pinboard_messages.update({"pinboards_message" : str(pinboardmsg.id)}, doc_ids=[pinboard.doc_id])
-                # At least try cleaning up the old message
-                if message_obj:
-                    try:
-                        await message_obj.delete()
-                    except:
-                        logging.info("update_pinboards: Deleting old pinned message was not successful.")
+                    logging.info("refresh_pinboard: Deleting old pinned message was not successful.")
+            return "reposted"
 
     # Fee coop to show or create a game
     @fee.subcommand(
@@ -933,47 +1273,14 @@ class FeeCoop(interactions.Extension):
     async def show_or_create_game(self, ctx: interactions.CommandContext, code : str = "", server_only=False, group_pass="", ephemeral=False):
         logging.info("Show or create game by user " + ctx.user.username + "#" + ctx.user.discriminator + " Code: " + code + " Server_only: " + str(server_only) + " group pass: " + group_pass)
         code = code.upper()
-        game_search_fragment = {"code" : code, "status" : "open"}
-        GamesQ = Query()
-        games = self.db.search(GamesQ.fragment(game_search_fragment))
-        if (games) and len(games) > 0:
-            embed = await self.build_embed_for_game(doc_id=games[0].doc_id, show_private_information=False, for_server=ctx.guild_id)
-            components = await self.build_components_for_game(doc_id=games[0].doc_id, for_user=None)
+        doc_ids = self.game_index.find_by_code(code, status="open")
+        if doc_ids:
+            entry = self.db.get_game(doc_ids[0])
+            embed = await self.build_embed_for_game(doc_id=entry.doc_id, show_private_information=False, for_server=ctx.guild_id, entry=entry)
+            components = await self.build_components_for_game(doc_id=entry.doc_id, for_user=None, entry=entry)
             return await ctx.send(embeds=[embed], components=components, ephemeral=ephemeral)
         else:
             # Send the user a message so a new game can be created
-            options = []
-            for mapid, mapinfo in enumerate(self.mapdata):
-                if mapid == 0:
-                    continue
-                # List all maps that we have
-                difficulty = mapinfo["difficulty"]
-                mapname = mapinfo["name"]
-                maxturns = mapinfo["maxturns"]
-                maxplayers = mapinfo["maxplayers"]
-                try: 
-                    mapemoji = self.emoji["map" + str(mapid)]
-                    start = mapemoji.find(":", mapemoji.find(":") + 1) + 1
-                    end = mapemoji.find(">")
-                    emoji_id = mapemoji[start:end]
-                    emoji = interactions.Emoji(id=emoji_id)
-                except:
-                    emoji = None
-                possible_rewards = mapinfo["possible_rewards"]
-                options.append(SelectOption(label=mapname + "(" + difficulty + ")", 
-                                            value=mapid,
-                                            description=str("Turns: " + str(maxturns) + " Players: " + str(maxplayers) + " Rewards: "  + ",".join(possible_rewards))[:100],
-                                            emoji=emoji
-                                            )
-                                        )
-                if len(options) == 25:
-                    break
-            s1 = SelectMenu(
-                            custom_id="select_map",
-                            placeholder="Select map for new game",
-                            options=options,
-                        )
-            components = [[s1]]
             color = assign_color_to_user(ctx.user.username)
             title = code.replace(" ", "") + " - Adding new game"
             embed = interactions.Embed( title=title, 
@@ -985,7 +1292,7 @@ class FeeCoop(interactions.Extension):
             embed.set_author(name=ctx.user.username + "#" + ctx.user.discriminator, icon_url=ctx.user.avatar_url)
             # Server only makes only sense if we are on a server
             if ctx.guild_id:
-                server_obj = await ctx.get_guild()
+                server_obj = await self.discord_cache.get_guild(ctx.guild_id)
             else:
                 server_only = False
             # Group pass beats server ID
@@ -995,6 +1302,11 @@ class FeeCoop(interactions.Extension):
                 embed.set_footer(text="Only for server: " + server_obj.name, icon_url=server_obj.icon_url)
             if group_pass:
                 ephemeral = True
+            # The map select menu carries the new game to select_map. The game keeps only 20 characters of the group pass.
+            custom_id = encode_custom_id("select_map", int(bool(server_only)), code.replace(" ", ""), group_pass[0:20])
+            if not custom_id:
+                return await ctx.send("The code " + code + " is too long.", ephemeral=True)
+            components = [[self.maps.select_menu(custom_id)]]
             return await ctx.send(embeds=[embed], components=components, ephemeral=ephemeral)
         
     # Autocompletion for the parameter "group_pass". Searches for previous group passes of that user and shows them
@@ -1006,26 +1318,18 @@ class FeeCoop(interactions.Extension):
         added_group_passes = []  
 
         # If the user has set a group pass to be notified about, that is probably the users favorite group pass, show it first
-        user_config = self.db.table("user_config")
-        UserQ = Query()
-        entry = user_config.get(UserQ.user == str(ctx.user.id))
+        entry = self.subscriber_index.get(ctx.user.id)
         if entry:
             notifications_group_pass = entry.get("notifications_group_pass", "")
             if notifications_group_pass:
                 added_group_passes.append(notifications_group_pass)
                 options.append(interactions.Choice(name=notifications_group_pass, value=notifications_group_pass))
           
-        # Get a list of all games which have a group pass, and where the user participated in
-        GamesQ = Query()
-        TurnsQ = Query()
-        games = self.db.search((GamesQ.group_pass != "") & (GamesQ.status != "abandoned") & (GamesQ.turns.any(TurnsQ.user == str(ctx.user.id))))
-
-        # Now just check all these games for the group passes
-        for entry in games:
+        # Then the group passes the user used lately, newest first
+        for group_pass in self.group_pass_history.recent(ctx.user.id):
             # Maximum of 25 results are allowed in discord. 
             if len(options) >= 25:
                 break
-            group_pass = entry.get("group_pass")
             if group_pass not in added_group_passes:
                 if user_input in group_pass:
                     added_group_passes.append(group_pass)
@@ -1040,35 +1344,24 @@ class FeeCoop(interactions.Extension):
         options = []
 
         # Before we read all open codes, check if the user belongs to a certain group pass
-        user_config = self.db.table("user_config")
-        UserQ = Query()
-        entry = user_config.get(UserQ.user == str(ctx.user.id))
+        entry = self.subscriber_index.get(ctx.user.id)
         notifications_group_pass = ""
         if entry:
             notifications_group_pass = entry.get("notifications_group_pass", "")
 
-        # Get a list of all open games which either have no group pass, or the default group pass
-        GamesQ = Query()
-        games = self.db.search(((GamesQ.group_pass == "") | (GamesQ.group_pass == notifications_group_pass)) & (GamesQ.status == "open"))
-
-        # Now just check all these games for the group passes
-        for entry in games:
-            # Maximum of 25 results are allowed in discord. 
-            if len(options) >= 25:
-                break
-            code = entry.get("code")
-            if user_input.upper() in code.upper():
-                options.append(interactions.Choice(name=code, value=code))
+        # All open games which either have no group pass, or the default group pass. Maximum of 25 results are allowed in discord.
+        for code in self.game_index.find_open_codes(user_input, group_passes=["", notifications_group_pass], limit=25):
+            options.append(interactions.Choice(name=code, value=code))
 
         await ctx.populate(options)
 
    # Join the game
-    @interactions.extension_component("join_game")
     async def fee_join_game(self, ctx):
-        # Get the open game from the last message
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
-        if not doc_id:
-            return await ctx.send("Could not find game, maybe it was finished already?", ephemeral=True)
+        # Get the open game the button was made for
+        entry, changed = await self.get_game_from_component(ctx, status="open")
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find game, maybe it was finished already?"), ephemeral=True)
+        doc_id = entry.doc_id
 
         # Last message hidden or not? - For new we avoid spam and send always ephemeral
         # if ctx.message.flags == 64:
@@ -1077,20 +1370,14 @@ class FeeCoop(interactions.Extension):
         #     ephemeral = False
         ephemeral = True
 
-        # Game found?
-        if not doc_id:
-            return await ctx.send("Could not join game, maybe it was finished already?", ephemeral=True)
-
-        entry = self.db.get(doc_id=doc_id)
-
         # Tell the user how to join the game
-        server_only = entry.get("server_only")
-        group_pass = entry.get("group_pass")
-        turns = entry.get("turns", [])
+        server_only = entry.server_only
+        group_pass = entry.group_pass
+        turns = entry.turns
         if len(turns) > 0:
-            started_serverid = turns[0]["server"]
+            started_serverid = entry.host_server
             if started_serverid:
-                started_serverobj = await interactions.get(self.bot, interactions.Guild, object_id=started_serverid)
+                started_serverobj = await self.discord_cache.get_guild(started_serverid)
 
         added_description = "Join the game using the above code in Fire Emblem Engage: Relay Trials now!"
         if server_only and started_serverid:
@@ -1099,18 +1386,18 @@ class FeeCoop(interactions.Extension):
             added_description += "\nPlease note that the game opener only wants users with a group pass to join."
         added_description += "\n\nOnce you finished your turns, please use the buttons below to update the game status."
 
-        embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=ctx.guild_id)
+        embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=ctx.guild_id, entry=entry)
         embed.description = added_description + "\n\n\n" + embed.description
         embed.description = embed.description[0:4096]
 
         # Determine which buttons need to be disabled for this user. 
         last_turn = False
-        map = entry["map"]
-        maxplayers = self.mapdata[map]["maxplayers"]
+        map = entry.map
+        maxplayers = self.maps.get(map).maxplayers
         if len(turns) >= (maxplayers - 1):
             last_turn = True
         # If the user already participated in the game, dont participate again!
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user, entry=entry)
         if user_is_participant or last_turn:
             # If this is the last turn, game cant be ongoing anymore, either win or lose now
             ongoing_button_disabled = True
@@ -1118,46 +1405,43 @@ class FeeCoop(interactions.Extension):
             ongoing_button_disabled = False
 
         # Make the buttons to ask the user if it worked or not
-        b1 = Button(style=3, custom_id="game_ongoing", label="Still ongoing", emoji=interactions.Emoji(id=1068863754713968700), disabled=ongoing_button_disabled)
-        b2 = Button(style=1, custom_id="game_success", label="Success!", emoji=interactions.Emoji(id=1068852878661398548), disabled=user_is_participant)
-        b3 = Button(style=2, custom_id="game_over", label="Game Over", emoji=interactions.Emoji(id=1068852433129832558), disabled=user_is_participant)
+        b1 = Button(style=3, custom_id=self.build_game_custom_id("game_ongoing", entry), label="Still ongoing", emoji=interactions.Emoji(id=1068863754713968700), disabled=ongoing_button_disabled)
+        b2 = Button(style=1, custom_id=self.build_game_custom_id("game_success", entry), label="Success!", emoji=interactions.Emoji(id=1068852878661398548), disabled=user_is_participant)
+        b3 = Button(style=2, custom_id=self.build_game_custom_id("game_over", entry), label="Game Over", emoji=interactions.Emoji(id=1068852433129832558), disabled=user_is_participant)
 
         # Button to vote for removal of the game
         deadgamelabel = "Dead game? Delete entry"
-        deletion_votes = entry.get("deletion_votes", [])
+        deletion_votes = entry.deletion_votes
         if len(deletion_votes) > 0:
             deadgamelabel = "Dead game (" + str(len(deletion_votes)) + "/3 votes)"
-        b4 = Button(style=4, custom_id="join_game_failed", label=deadgamelabel, emoji=interactions.Emoji(id=1068863333526151230))
+        b4 = Button(style=4, custom_id=self.build_game_custom_id("join_game_failed", entry), label=deadgamelabel, emoji=interactions.Emoji(id=1068863333526151230))
         components = spread_to_rows(b1, b2, b3, b4)
 
         return await ctx.send(embeds=[embed], components=components, ephemeral=ephemeral)
 
-    # Create a new game or reopen an existing one
-    async def create_new_game(self, ctx, doc_id=None, code=None, server_only=False, group_pass="", map=None):
+    # Create a new game or reopen an existing one. If the existing game is at hand already, it can be passed as entry.
+    async def create_new_game(self, ctx, doc_id=None, code=None, server_only=False, group_pass="", map=None, entry=None):
         # Update an existing game?
         if doc_id:
             # Is the game ID still free?
-            entry = self.db.get(doc_id=doc_id)
-            code = entry.get("code")
-            game_search_fragment = {"code" : code, "status" : "open"}
-            GamesQ = Query()
-            games = self.db.search(GamesQ.fragment(game_search_fragment))
-            if (games) and len(games) > 0:
+            if entry is None:
+                entry = self.db.get_game(doc_id)
+            code = entry.code
+            if self.game_index.find_by_code(code, status="open"):
                 # Game already exists
                 return await ctx.send("Can not reinstate old game, because a new game with the code " + code + " already exists.", ephemeral=True)
 
             await ctx.defer(ephemeral=True)
             # Just update status and timestamp
-            turns = entry.get("turns")
-            turns[-1]["timestamp"] = datetime.datetime.utcnow().isoformat()
-            self.db.update({"status" : "open", "turns": turns}, doc_ids=[doc_id])
+            turns = entry.turns[:-1] + [entry.turns[-1].touched()]
+            self.store_game_changes(doc_id, {"status" : "open", "turns": turns})
             embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=True, for_server=ctx.guild_id)
             this_server_id = ""
             if ctx.guild_id:
                 this_server_id = str(ctx.guild_id)
-            group_pass = entry.get("group_pass")
-            server_only = entry.get("server_only")
-            await self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
+            group_pass = entry.group_pass
+            server_only = entry.server_only
+            self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
             return await ctx.send(embeds=[embed], ephemeral=True)
         elif code:
             # If previous message was ephemeral or if group pass locked, dont show public
@@ -1165,10 +1449,7 @@ class FeeCoop(interactions.Extension):
             if ctx.message.flags == 64 or group_pass:
                 ephemeral = True
                 
-            game_search_fragment = {"code" : code, "status" : "open"}
-            GamesQ = Query()
-            games = self.db.search(GamesQ.fragment(game_search_fragment))
-            if (games) and len(games) > 0:
+            if self.game_index.find_by_code(code, status="open"):
                 return await ctx.send("An open game with the code " + code + " already exists!", ephemeral=True)
 
             await ctx.defer(ephemeral)
@@ -1180,29 +1461,21 @@ class FeeCoop(interactions.Extension):
             else:
                 server_only = False
 
-            # Mapdata contains always one more map than actually exist because the first mapdata entry is always blank
-            if map < 1 or (map > (len(self.mapdata) - 1)):
+            if not self.maps.is_known(map):
                 return await ctx.send("Map number " + str(map) + " unknown!", ephemeral=True)
             
             group_pass = group_pass[0:20]
-            new_item = {    "code": code, 
-                            "map": map, 
-                            "server_only" : server_only,
-                            "group_pass" : group_pass, 
-                            "status" : "open",
-                            "turns" : [
-                                    {
-                                        "user" : str(ctx.user.id),
-                                        "server" : this_server_id,
-                                        "timestamp" : datetime.datetime.utcnow().isoformat(),
-                                    }
-                                ],
-                        }
+            new_item = Game(code=code,
+                            map=map,
+                            server_only=server_only,
+                            group_pass=group_pass,
+                            status="open",
+                            turns=[Turn(user=str(ctx.user.id), server=this_server_id)])
 
             # Update database and inform users 
-            doc_id = self.db.insert(new_item) 
+            doc_id = self.store_new_game(new_item)
             await self.notify_users(ctx=ctx, doc_id=doc_id, server_only=server_only, group_pass=group_pass)
-            await self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
+            self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
 
             # Now show that a new game was added
             embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=ephemeral, for_server=ctx.guild_id)
@@ -1213,18 +1486,20 @@ class FeeCoop(interactions.Extension):
             return await ctx.send("Creating new game failed.", ephemeral=True)
 
     # Abandon the game
-    @interactions.extension_component("abandon_game")
     async def fee_abandon_game(self, ctx):
-        # Get the open game from the last message
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
+        # Get the open game the button was made for
+        entry, changed = await self.get_game_from_component(ctx, status="open")
 
         # Game found?
-        if not doc_id:
-            return await ctx.send("Could not find open game, maybe it was finished meanwhile?", ephemeral=True)
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find open game, maybe it was finished meanwhile?"), ephemeral=True)
+        if changed:
+            return await self.send_outdated_game(ctx, entry)
+        doc_id = entry.doc_id
         
         await ctx.defer(ephemeral=True)
         # Game deletion allowed?
-        delete_game_allowed = await self.can_user_delete_game(doc_id=doc_id, user=ctx.user)
+        delete_game_allowed = await self.can_user_delete_game(doc_id=doc_id, user=ctx.user, entry=entry)
         if not delete_game_allowed:
             return await ctx.send("Not allowed to remove the game! The players have a few days to finish this. If no activity is found after a few days, you can try deleting it again.", ephemeral=True)
 
@@ -1238,21 +1513,22 @@ class FeeCoop(interactions.Extension):
         deletion_votes = [deletion_vote]
 
         # Delete the game and send the host a info message
-        return await self.delete_game_and_message_host(ctx, doc_id, deletion_votes)     
+        return await self.delete_game_and_message_host(ctx, doc_id, deletion_votes, entry=entry)     
 
     # Reinstate the game
-    @interactions.extension_component("reinstate_game")
     async def fee_reinstate_game(self, ctx):
-        doc_id = await self.get_doc_id_from_message(ctx, status="abandoned")
-        if not doc_id:
-            return await ctx.send("Could not find abandoned game, maybe it was reinstated already?", ephemeral=True)
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user)
+        entry, changed = await self.get_game_from_component(ctx, status="abandoned")
+        if not entry or entry.status != "abandoned":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find abandoned game, maybe it was reinstated already?"), ephemeral=True)
+        if changed:
+            return await self.send_outdated_game(ctx, entry)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=entry.doc_id, user=ctx.user, entry=entry)
         if not user_is_host:
             return await ctx.send("Only the host can reinstate this old game.", ephemeral=True)
-        return await self.create_new_game(ctx=ctx, doc_id=doc_id)
+        return await self.create_new_game(ctx=ctx, doc_id=entry.doc_id, entry=entry)
 
-    # Update the games status
-    async def update_game(self, ctx, doc_id = None, new_status = "open"):
+    # Update the games status. If the game is at hand already, it can be passed as entry.
+    async def update_game(self, ctx, doc_id = None, new_status = "open", entry = None):
         # If previous message was ephemeral, set this to ephemeral too
         if ctx.message and ctx.message.flags and ctx.message.flags == 64:
             ephemeral = True
@@ -1273,81 +1549,50 @@ class FeeCoop(interactions.Extension):
         # Game found?
         if not doc_id:
             return await ctx.send("Game not found", ephemeral=True)
-        entry = self.db.get(doc_id=doc_id)
-        old_status = entry.get("status")
+        if entry is None:
+            entry = self.db.get_game(doc_id)
+        old_status = entry.status
         if old_status != "open": 
             return await ctx.send("Game has been finished or abandoned by now! No update possible.", ephemeral=True)
 
         await ctx.defer(ephemeral=ephemeral)
 
-        # Update game status
-        self.db.update({"status" : new_status}, doc_ids=[doc_id])
-        # Add the new user
-        turns = entry.get("turns", [])
+        # Add the new user and update the game status in one go
         this_server_id = ""
         if ctx.guild_id:
             this_server_id = str(ctx.guild_id)
-        new_turn = {
-                    "user" : str(ctx.user.id),
-                    "server" : this_server_id,
-                    "timestamp" : datetime.datetime.utcnow().isoformat(),
-                }
-        turns.append(new_turn)
-        self.db.update({"turns" : turns}, doc_ids=[doc_id])
-
-        # Build an embed with the new game data
-        embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=None)
+        new_turn = Turn(user=str(ctx.user.id), server=this_server_id)
+        self.store_game_changes(doc_id, {"status" : new_status}, add_turn=new_turn)
 
         # Add a picture if the game is fininshed, either way
-        files = None
         if new_status == "success" or new_status == "finished":
-            final_picture_path, final_picture_name = await self.get_finished_picture(status=new_status)
-            embed.set_image(url="attachment://" + final_picture_name)
-        
-            # If the game is finished, send a message to everyone involved except for the last user    
-            turns.pop()
-            for turn in turns:
-                userid = turn["user"]
-                userobj = await interactions.get(self.bot, interactions.User, object_id=userid)
-                userobj._client = self.client._http
-                f = open(final_picture_path, mode='rb')
-                fxy = interactions.File(
-                    filename=final_picture_name,
-                    fp=f,
-                    description=str("Fee coop file")
-                    )
-                files = [fxy]
-                logging.info("Update_game: Sending private message to " + userobj.username + "#" + userobj.discriminator)
-                try:
-                    await userobj.send(embeds=[embed], files=files)
-                except interactions.api.LibraryException as e:
-                    logging.info("Update_game: Failed to send private message, " + str(e))
-
-            # We have to provide the file again and again for every single send
-            f = open(final_picture_path, mode='rb')
-            fxy = interactions.File(
-                filename=final_picture_name,
-                fp=f,
-                description=str("Fee coop file")
-                )
-            files = [fxy]
+            final_picture_name = self.assets.random_picture(new_status)
+            # Build an embed with the new game data. Uploads the picture, unless it was uploaded a short while ago already.
+            embed, files = await self.build_finished_game_message(doc_id, new_status, final_picture_name)
+            updatemessage = await ctx.send(embeds=[embed], files=files, ephemeral=ephemeral)
+            if files:
+                self.assets.remember_upload(final_picture_name, updatemessage)
+
+            # If the game is finished, send a message to everyone involved except for the last user. They get the picture from the upload above.
+            self.dm_queue.send_many([("game_finished", doc_id, turn.user, {"status" : new_status, "picture_name" : final_picture_name}) for turn in entry.turns])
+        else:
+            # Build an embed with the new game data
+            embed = await self.build_embed_for_game(doc_id=doc_id, show_private_information=False, for_server=None)
 
-        # Update message in the current channel for the updating user
-        updatemessage = await ctx.send(embeds=[embed], files=files, ephemeral=ephemeral)
+            # Update message in the current channel for the updating user
+            updatemessage = await ctx.send(embeds=[embed], ephemeral=ephemeral)
 
         # Update all pinboards
-        group_pass = entry.get("group_pass")
-        server_only = entry.get("server_only")
-        await self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
+        group_pass = entry.group_pass
+        server_only = entry.server_only
+        self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
         
         return updatemessage
 
     # Expects ctx.channel_id and returns the channels pinboard message if it exists, otherwise None
     async def get_pinboard_message_for_channel(self, channel_id):
         pinboardmsg = None
-        pinboard_messages = self.db.table("pinboards")
-        PinBoardQ = Query()
-        entry = pinboard_messages.get(PinBoardQ.pinboards_channel == str(channel_id))
+        entry = self.db.get_pinboard_for_channel(channel_id)
         if entry:
             # This channel has already a pinned message
             existing_message_id = entry.get("pinboards_message")
@@ -1356,52 +1601,54 @@ class FeeCoop(interactions.Extension):
                 pinboardmsg = await interactions.get(self.bot, interactions.Message, object_id=existing_message_id, parent_id=channel_id)
             except interactions.api.LibraryException:
                 # The pinboard message doesnt exist anymore, clean up database too while we are at it
-                pinboard_messages.remove(doc_ids=[entry.doc_id])
+                self.remove_pinboard(entry.doc_id)
                 pinboardmsg = None
         return pinboardmsg
 
     # Continue game
-    @interactions.extension_component("game_ongoing")
     async def game_ongoing(self, ctx):
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
-        if not doc_id:
-            return await ctx.send("Could not find game, maybe it was finished already?", ephemeral=True)
+        entry, changed = await self.get_game_from_component(ctx, status="open")
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find game, maybe it was finished already?"), ephemeral=True)
+        doc_id = entry.doc_id
         # User already in the game?
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user, entry=entry)
         if user_is_participant:
             return await ctx.send("You have arleady participated in the game.", ephemeral=True)
-        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="open")
+        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="open", entry=entry)
 
     # Game successfully finished!
-    @interactions.extension_component("game_success")
     async def game_success(self, ctx):
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
-        if not doc_id:
-            return await ctx.send("Could not find game, maybe it was finished already?", ephemeral=True)                
+        entry, changed = await self.get_game_from_component(ctx, status="open")
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find game, maybe it was finished already?"), ephemeral=True)
+        doc_id = entry.doc_id                
         # User already in the game?
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user, entry=entry)
         if user_is_participant:
             return await ctx.send("You have arleady participated in the game.", ephemeral=True)
-        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="success")
+        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="success", entry=entry)
 
     # Game successfully finished!
-    @interactions.extension_component("game_over")
     async def game_over(self, ctx):
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
-        if not doc_id:
-            return await ctx.send("Could not find game, maybe it was finished already?", ephemeral=True)
+        entry, changed = await self.get_game_from_component(ctx, status="open")
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find game, maybe it was finished already?"), ephemeral=True)
+        doc_id = entry.doc_id
         # User already in the game?
-        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user)
+        user_is_participant, user_is_host = await self.is_user_in_game(doc_id=doc_id, user=ctx.user, entry=entry)
         if user_is_participant:
             return await ctx.send("You have arleady participated in the game.", ephemeral=True)
-        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="finished")
+        return await self.update_game(ctx=ctx, doc_id=doc_id, new_status="finished", entry=entry)
 
     # Join game failed
-    @interactions.extension_component("join_game_failed")
     async def join_game_failed(self, ctx):
-        doc_id = await self.get_doc_id_from_message(ctx, status="open")
-        if not doc_id:
-            return await ctx.send("Could not find game, maybe it was finished already?", ephemeral=True)
+        entry, changed = await self.get_game_from_component(ctx, status="open")
+        if not entry or entry.status != "open":
+            return await ctx.send(self.game_not_found_message(entry, changed, "Could not find game, maybe it was finished already?"), ephemeral=True)
+        if changed:
+            return await self.send_outdated_game(ctx, entry)
+        doc_id = entry.doc_id
 
         await ctx.defer(ephemeral=True)
         user_id = str(ctx.user.id)
@@ -1410,8 +1657,7 @@ class FeeCoop(interactions.Extension):
             this_server_id = str(ctx.guild_id)
 
         # Check how many votes we have to delete this game
-        entry = self.db.get(doc_id=doc_id)
-        deletion_votes = entry.get("deletion_votes", [])
+        deletion_votes = entry.deletion_votes
         if user_id in [deletion_vote['user'] for deletion_vote in deletion_votes]:
             return await ctx.send("You already voted to delete this game. Right now " + str(len(deletion_votes)) + " users voted to delete this game.", ephemeral=True)
         
@@ -1420,16 +1666,14 @@ class FeeCoop(interactions.Extension):
         deletion_vote['user'] = user_id
         deletion_vote['server'] = this_server_id
         deletion_votes.append(deletion_vote)
-        self.db.update({"deletion_votes" : deletion_votes}, doc_ids=[entry.doc_id])
+        self.store_game_changes(entry.doc_id, add_deletion_vote=deletion_vote)
 
         # Do we have enough votes to delete the game?
         game_voted_for_deletion = False
 
         # Host can always delete
-        turns = entry.get("turns", [])
-        if len(turns) > 0:
-            if user_id == turns[0]['user']:
-                game_voted_for_deletion = True
+        if user_id == entry.host_user:
+            game_voted_for_deletion = True
         
         # 3 unique users can delete
         if len(deletion_votes) > 2:
@@ -1444,30 +1688,49 @@ class FeeCoop(interactions.Extension):
             return await ctx.send("Your vote to delete this game from the bot list has been accepted. Right now " + str(len(deletion_votes)) + " users voted to delete this game.", ephemeral=True)
         
         # Now delete the game and message the host
-        return await self.delete_game_and_message_host(ctx, doc_id, deletion_votes) 
+        return await self.delete_game_and_message_host(ctx, doc_id, deletion_votes, entry=entry) 
 
     # Delete a game and send the host a note that it was deleted by user vote
-    async def delete_game_and_message_host(self, ctx, doc_id, deletion_votes):
-        entry = self.db.get(doc_id=doc_id)
-        self.db.update({"status" : "abandoned"}, doc_ids=[doc_id])
+    async def delete_game_and_message_host(self, ctx, doc_id, deletion_votes, entry=None):
+        if entry is None:
+            entry = self.db.get_game(doc_id)
+        self.store_game_changes(doc_id, {"status" : "abandoned"})
 
         # Game deleted, update pinboards
         this_server_id = ""
         if ctx.guild_id:
             this_server_id = str(ctx.guild_id)
-        group_pass = entry.get("group_pass")
-        server_only = entry.get("server_only")
-        await self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
+        group_pass = entry.group_pass
+        server_only = entry.server_only
+        self.update_pinboards(game_wants_server_only=server_only, server_id=this_server_id, group_pass=group_pass)
+
+        # Get the host user
+        started_userid = entry.host_user
+
+        # If this is the host, simple update message. If it is not the host, send the host a private message.
+        try:
+            await ctx.message.delete()
+        except:
+            logging.info("Tried deleting old message in delete_game_and_message_host. Failed. Not a problem.")
+        if str(ctx.user.id) == started_userid:
+            embed, components = await self.build_deleted_game_message(doc_id, deletion_votes, ctx.user)
+            return await ctx.send(embeds=[embed], components=components, ephemeral=True)
+        else:
+            logging.info("delete_game_and_message_host: Sending private message to " + started_userid)
+            self.dm_queue.send("game_deleted", doc_id, started_userid, {"deletion_votes" : deletion_votes})
+            return await ctx.send("Game abandoned with " + str(len(deletion_votes)) + " votes. The host can reinstate the game anytime if desired.", ephemeral=True)      
 
+    # Message for the host of a game which got abandoned by votes, with the button to reinstate it
+    async def build_deleted_game_message(self, doc_id, deletion_votes, for_user):
         # Get a list of who deleted the game
         deletion_voters_list = ""
         for deletion_vote in deletion_votes:
             userid = deletion_vote['user']
             serverid = deletion_vote['server']
-            userobj = await interactions.get(self.bot, interactions.User, object_id=userid)
+            userobj = await self.discord_cache.get_user(userid)
             deletion_voters_list += "\n" + userobj.username + "#" + userobj.discriminator
             if serverid:
-                serverobj = await interactions.get(self.bot, interactions.Guild, object_id=serverid)
+                serverobj = await self.discord_cache.get_guild(serverid)
                 deletion_voters_list += " from server " + serverobj.name
             
         # Build an embed for the host to reinstate the game if needed
@@ -1475,29 +1738,9 @@ class FeeCoop(interactions.Extension):
         embed.description = "This game has been **abandoned** on the request of:\n" + deletion_voters_list + "\n\nIt is likely that your game has been already finished but was still listed in the bot as open. If you want to list the game as open game again, just click the button below to **reinstate** it.\n\n\n" + embed.description
         embed.description = embed.description[0:4096]
 
-        # Get the host user and build components for him
-        turns = entry.get("turns", [])
-        started_userid = turns[0]["user"]
-        started_userobj = await interactions.get(self.bot, interactions.User, object_id=started_userid)
-
         # Host gets the "create new game" button
-        components = await self.build_components_for_game(doc_id=entry.doc_id, for_user=started_userobj)
-
-        # If this is the host, simple update message. If it is not the host, send the host a private message.
-        try:
-            await ctx.message.delete()
-        except:
-            logging.info("Tried deleting old message in delete_game_and_message_host. Failed. Not a problem.")
-        if str(ctx.user.id) == started_userid:
-            return await ctx.send(embeds=[embed], components=components, ephemeral=True)
-        else:
-            started_userobj._client = self.client._http
-            logging.info("delete_game_and_message_host: Sending private message to " + started_userobj.username + "#" + started_userobj.discriminator)
-            try:
-                await started_userobj.send(embeds=[embed], components=components)
-            except interactions.api.LibraryException as e:
-                logging.info("delete_game_and_message_host: Failed to send private message, " + str(e))
-            return await ctx.send("Game abandoned with " + str(len(deletion_votes)) + " votes. The host can reinstate the game anytime if desired.", ephemeral=True)      
+        components = await self.build_components_for_game(doc_id=doc_id, for_user=for_user)
+        return embed, components
 
     # Select menu processing of game select
     @interactions.extension_component("show_game_docid")
@@ -1516,24 +1759,15 @@ class FeeCoop(interactions.Extension):
         return await ctx.send(embeds=[embed], components=components, ephemeral=ephemeral)
 
     # Select menu creating new game from mapid
-    @interactions.extension_component("select_map")
-    async def select_map(self, ctx, value):
+    async def select_map(self, ctx):
         # Map was selected
-        map = int(value[0])
-        # And game ID is the first item in the title
-        if not ctx.message.embeds:
-            return await ctx.send("Failed to create game", ephemeral=True)
-        code = ctx.message.embeds[0].title.split()[0]
-        # Server only or group pass is in the footer
-        footer = ""
-        if ctx.message.embeds[0].footer:
-            footer = ctx.message.embeds[0].footer.text
-        group_pass = ""
-        server_only = False
-        if "Group pass" in footer:
-            group_pass = footer.split()[2]
-        elif "Only for server" in footer:
-            server_only = True
+        map = int(ctx.data.values[0])
+        # Code, server only and group pass come with the custom_id
+        fields = decode_custom_id(ctx.data.custom_id, 3)
+        if len(fields) < 3:
+            return await ctx.send("This menu is outdated, please use /fee coop again.", ephemeral=True)
+        server_only, code, group_pass = fields
+        server_only = bool(from_base36(server_only) & 1)
         try:
             await ctx.message.delete()
         except:
@@ -1547,8 +1781,10 @@ class FeeCoop(interactions.Extension):
     )
     async def fee_coop_rightclick_show_game(self, ctx):
         game_ids = ctx.target.content.split()
-        Games = Query()
-        results = self.db.search(Games.code.one_of(game_ids))
+        doc_ids = set()
+        for code in game_ids:
+            doc_ids.update(self.game_index.find_by_code(code))
+        results = self.db.get_games(doc_ids)
         if len(results) > 0:
             found_games = []
             embed_counter = 0
@@ -1562,19 +1798,12 @@ class FeeCoop(interactions.Extension):
                     components = await self.build_components_for_game(doc_id=result.doc_id, for_user=ctx.user)
                 else:
                     # Multiple games? Then build a select menu for joining one
-                    map = result.get("map")
-                    mapname = self.mapdata[map]["name"]
-                    mapemoji = self.emoji["map" + str(map)]
-                    start = mapemoji.find(":", mapemoji.find(":") + 1) + 1
-                    end = mapemoji.find(">")
-                    emoji_id = mapemoji[start:end]
-                    emoji = interactions.Emoji(id=emoji_id)
-                    turns = result["turns"]
-                    started_userid = turns[0]["user"]
-                    started_serverid = turns[0]["server"]
-                    started_userobj = await interactions.get(self.bot, interactions.User, object_id=started_userid)
+                    map_info = self.maps.get(result.map)
+                    started_userid = result.host_user
+                    started_serverid = result.host_server
+                    started_userobj = await self.discord_cache.get_user(started_userid)
                     if started_serverid:
-                        started_serverobj = await interactions.get(self.bot, interactions.Guild, object_id=started_serverid)
+                        started_serverobj = await self.discord_cache.get_guild(started_serverid)
                     username = started_userobj.username + "#" + started_userobj.discriminator
                     this_server_id = ""
                     if ctx.guild_id:
@@ -1582,10 +1811,10 @@ class FeeCoop(interactions.Extension):
                     if started_serverid and started_serverid != this_server_id:
                         username += " (server " + started_serverobj.name + ")"
                     if len(options) < 25:
-                        options.append(SelectOption(label=result.get("code"), 
+                        options.append(SelectOption(label=result.code, 
                                                         value=result.doc_id, 
-                                                        description=str(mapname + " by " + username)[:100],
-                                                        emoji=emoji
+                                                        description=str(map_info.name + " by " + username)[:100],
+                                                        emoji=map_info.emoji
                                                         )
                                                     )
                 # Max amount of discord embeds
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import logging
+import time
+import aiohttp
+import interactions
+
+# A private message waiting for delivery. Only says what to send, the message itself is rendered right before sending.
+# kind: "new_game", "game_finished", "game_purged" or "game_deleted". extra: whatever else the kind needs.
+# key: Idempotency key in the outbox, "<kind>:<doc_id>:<user_id>"
+PrivateMessage = collections.namedtuple("PrivateMessage", ["key", "kind", "doc_id", "user_id", "extra", "enqueued_at"])
+
+# Discord error codes where trying again is pointless
+PERMANENT_ERROR_CODES = [
+    10013, # Unknown user
+    50007, # Cannot send messages to this user, for example because the user blocked the bot or turned off DMs
+]
+
+# Network trouble on the way to discord. Tried again like the discord errors.
+TRANSIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
+
+# Delivers private messages in the background. Callers enqueue and go on, a few workers send the messages.
+# Sends are spaced out over all workers so a big notification round doesn't run into the rate limits,
+# failed sends are tried again with growing waits in between.
+# Messages are kept in the outbox until they are delivered or given up on, so a restart continues where the last run stopped.
+class DmQueue:
+    def __init__(self, get_user, render, outbox, workers=3, interval=0.5, max_attempts=4, retry_delay=2.0):
+        # Coroutine function: user id -> user object which can send
+        self.get_user = get_user
+        # Coroutine function: (PrivateMessage, user object) -> keyword arguments for user.send, or None to skip the message
+        self.render = render
+        self.outbox = outbox
+        self.worker_count = workers
+        # Seconds between two sends, over all workers
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue()
+        self.workers = []
+        self.next_send_at = 0
+        self.delivered = 0
+        self.failed = 0
+        self.skipped = 0
+        # Seconds from enqueue to delivery of the last messages
+        self.latencies = collections.deque(maxlen=200)
+
+    # Starts the workers, beginning with the messages the last run did not deliver anymore
+    def start(self):
+        if not self.workers:
+            undelivered = self.outbox.pending_items("dm")
+            if undelivered:
+                logging.info("DmQueue: Continuing with " + str(len(undelivered)) + " undelivered messages")
+            for key, value in undelivered:
+                self._enqueue(key, value)
+            self.workers = [asyncio.get_event_loop().create_task(self.work()) for _ in range(self.worker_count)]
+
+    def _enqueue(self, key, value):
+        self.queue.put_nowait(PrivateMessage(key=key, kind=value["kind"], doc_id=value["doc_id"], user_id=value["user_id"], extra=value["extra"], enqueued_at=time.monotonic()))
+
+    # Expects (kind, doc_id, user_id, extra) tuples. Everything is written to the outbox at once, then queued.
+    def send_many(self, messages):
+        values = {}
+        for kind, doc_id, user_id, extra in messages:
+            key = kind + ":" + str(doc_id) + ":" + str(user_id)
+            values[key] = {"kind" : kind, "doc_id" : doc_id, "user_id" : str(user_id), "extra" : extra or {}}
+        # Messages which are already waiting are not sent twice
+        for key in self.outbox.put_many([(key, "dm", value) for key, value in values.items()]):
+            self._enqueue(key, values[key])
+
+    def send(self, kind, doc_id, user_id, extra=None):
+        self.send_many([(kind, doc_id, user_id, extra)])
+
+    async def work(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.deliver(message)
+            except Exception as e:
+                self.failed += 1
+                logging.info("DmQueue: Delivering " + message.kind + " to " + message.user_id + " failed, giving up. " + type(e).__name__ + ": " + str(e))
+            # Delivered or given up, either way it is not tried again after a restart
+            self.outbox.done(message.key)
+            self.queue.task_done()
+            if self.queue.empty():
+                logging.info(self.stats())
+
+    # Waits until it is this workers turn to send something
+    async def wait_for_turn(self):
+        now = time.monotonic()
+        send_at = max(now, self.next_send_at)
+        self.next_send_at = send_at + self.interval
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def deliver(self, message):
+        for attempt in range(1, self.max_attempts + 1):
+            await self.wait_for_turn()
+            try:
+                user_obj = await self.get_user(message.user_id)
+                send_arguments = await self.render(message, user_obj)
+                if send_arguments is None:
+                    self.skipped += 1
+                    return
+                logging.info("DmQueue: Sending " + message.kind + " to " + user_obj.username + "#" + user_obj.discriminator)
+                await user_obj.send(**send_arguments)
+                self.delivered += 1
+                self.latencies.append(time.monotonic() - message.enqueued_at)
+                return
+            except interactions.api.LibraryException as e:
+                if e.code in PERMANENT_ERROR_CODES or attempt == self.max_attempts:
+                    self.failed += 1
+                    logging.info("DmQueue: Failed to send " + message.kind + " to " + message.user_id + ", giving up. " + str(e))
+                    return
+                logging.info("DmQueue: Failed to send " + message.kind + " to " + message.user_id + ", attempt " + str(attempt) + ". " + str(e))
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_attempts:
+                    self.failed += 1
+                    logging.info("DmQueue: Failed to send " + message.kind + " to " + message.user_id + ", giving up. " + type(e).__name__ + ": " + str(e))
+                    return
+                logging.info("DmQueue: Failed to send " + message.kind + " to " + message.user_id + ", attempt " + str(attempt) + ". " + type(e).__name__ + ": " + str(e))
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def stats(self):
+        text = "DmQueue: " + str(self.queue.qsize()) + " waiting, " + str(self.delivered) + " delivered, " + str(self.failed) + " failed, " + str(self.skipped) + " skipped"
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            text += ", latency median " + str(round(latencies[len(latencies) // 2], 2)) + "s, slowest " + str(round(latencies[-1], 2)) + "s"
+        return text
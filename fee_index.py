@@ -0,0 +1,576 @@
+import asyncio
+import bisect
+import collections
+import heapq
+import logging
+
+# Pieces of codes the code autocomplete looks up codes by, see GameIndex.open_code_grams
+CODE_GRAM_LENGTH = 3
+
+# In-memory lookup tables over all games, so the common searches don't need to scan the database.
+# The index only knows doc_ids and the searchable values; the full games still come from the storage.
+class GameIndex:
+    def __init__(self):
+        # code -> doc_id of the open game with this code. There should only be one open game per code.
+        self.open_by_code = {}
+        # code -> doc_ids of all games with this code, no matter the status
+        self.by_code = {}
+        # status -> doc_ids
+        self.by_status = {}
+        # group pass -> doc_ids. Blank is the group pass of public games.
+        self.by_group_pass = {}
+        # user id -> doc_ids of all games where the user took a turn
+        self.by_user = {}
+        # group pass -> sorted list of (upper case code, code, doc_id) of the open games, for the code autocomplete
+        self.open_codes = {}
+        # Every piece of up to CODE_GRAM_LENGTH characters of an upper case code -> doc_ids of the open games whose code contains it
+        self.open_code_grams = {}
+        # doc_id -> (code, status, group_pass, users) as currently indexed
+        self.indexed = {}
+
+    # Fills the index from a list of games
+    def load(self, games):
+        for entry in games:
+            self.update(entry)
+        logging.info("GameIndex: Indexed " + str(len(self.indexed)) + " games, " + str(len(self.open_by_code)) + " of them open.")
+
+    def _add_to(self, mapping, key, doc_id):
+        mapping.setdefault(key, set()).add(doc_id)
+
+    def _remove_from(self, mapping, key, doc_id):
+        doc_ids = mapping.get(key)
+        if doc_ids is None:
+            return
+        doc_ids.discard(doc_id)
+        if not doc_ids:
+            del mapping[key]
+
+    # Adds a new game or re-indexes a changed one. Expects the full Game.
+    def update(self, entry):
+        doc_id = entry.doc_id
+        code = entry.code
+        status = entry.status
+        group_pass = entry.group_pass
+        users = entry.participants
+        new_values = (code, status, group_pass, users)
+        old_values = self.indexed.get(doc_id)
+        if old_values == new_values:
+            return
+        if old_values:
+            self.remove(doc_id)
+
+        self.indexed[doc_id] = new_values
+        self._add_to(self.by_code, code, doc_id)
+        self._add_to(self.by_status, status, doc_id)
+        self._add_to(self.by_group_pass, group_pass, doc_id)
+        for user in users:
+            self._add_to(self.by_user, user, doc_id)
+        if status == "open":
+            self.open_by_code[code] = doc_id
+            bisect.insort(self.open_codes.setdefault(group_pass, []), (code.upper(), code, doc_id))
+            for gram in self._code_grams(code.upper()):
+                self._add_to(self.open_code_grams, gram, doc_id)
+
+    def remove(self, doc_id):
+        old_values = self.indexed.pop(doc_id, None)
+        if not old_values:
+            return
+        code, status, group_pass, users = old_values
+        self._remove_from(self.by_code, code, doc_id)
+        self._remove_from(self.by_status, status, doc_id)
+        self._remove_from(self.by_group_pass, group_pass, doc_id)
+        for user in users:
+            self._remove_from(self.by_user, user, doc_id)
+        if status == "open":
+            open_codes = self.open_codes[group_pass]
+            del open_codes[bisect.bisect_left(open_codes, (code.upper(), code, doc_id))]
+            if not open_codes:
+                del self.open_codes[group_pass]
+            for gram in self._code_grams(code.upper()):
+                self._remove_from(self.open_code_grams, gram, doc_id)
+        if self.open_by_code.get(code) == doc_id:
+            del self.open_by_code[code]
+            # Should there be another open game with the same code, it takes over
+            for other_doc_id in self.by_code.get(code, ()):
+                if self.indexed[other_doc_id][1] == "open":
+                    self.open_by_code[code] = other_doc_id
+                    break
+
+    def code_of(self, doc_id):
+        return self.indexed[doc_id][0]
+
+    def status_of(self, doc_id):
+        return self.indexed[doc_id][1]
+
+    def group_pass_of(self, doc_id):
+        return self.indexed[doc_id][2]
+
+    # The doc_ids of all games with this code and status. For open games there should be only one.
+    def find_by_code(self, code, status=None):
+        if status == "open":
+            doc_id = self.open_by_code.get(code)
+            if doc_id is None:
+                return []
+            return [doc_id]
+        doc_ids = self.by_code.get(code, set())
+        if status is not None:
+            doc_ids = [doc_id for doc_id in doc_ids if self.indexed[doc_id][1] == status]
+        return sorted(doc_ids)
+
+    # Codes of open games with one of the group passes which contain user_input, ignoring case. Same input, same codes, in code order.
+    # Codes starting with the input come first, found by binary search in the sorted lists and merged over all group passes before the limit applies.
+    # Only if those are not enough, codes which contain the input somewhere else follow, in code order too.
+    # Those are found through the pieces of the input in open_code_grams, so only games which can match get looked at.
+    def find_open_codes(self, user_input, group_passes, limit=25):
+        needle = user_input.upper()
+        buckets = [self.open_codes[group_pass] for group_pass in sorted(set(group_passes)) if group_pass in self.open_codes]
+        codes = []
+        found = set()
+        for upper_code, code, doc_id in heapq.merge(*[self._prefix_matches(bucket, needle) for bucket in buckets]):
+            if code not in found:
+                found.add(code)
+                codes.append(code)
+                if len(codes) >= limit:
+                    return codes
+
+        if not needle:
+            # Every code starts with nothing, they are all listed already
+            return codes
+        # Every piece of the needle is in the code, start with the rarest piece
+        grams = [self.open_code_grams.get(gram, set()) for gram in self._code_grams(needle, whole_length_only=True)]
+        grams.sort(key=len)
+        candidates = set(grams[0])
+        for other in grams[1:]:
+            candidates &= other
+        allowed_group_passes = set(group_passes)
+        matches = []
+        for doc_id in candidates:
+            code, status, group_pass, users = self.indexed[doc_id]
+            if group_pass in allowed_group_passes and code not in found and needle in code.upper():
+                matches.append(code)
+        for code in heapq.nsmallest(limit - len(codes), set(matches), key=lambda code: (code.upper(), code)):
+            codes.append(code)
+        return codes
+
+    # The pieces of an upper case code which open_code_grams knows it by: everything of up to CODE_GRAM_LENGTH characters.
+    # A needle only needs its pieces of the full length, or itself if it is shorter. Codes with all of them are the candidates.
+    def _code_grams(self, upper_code, whole_length_only=False):
+        if whole_length_only:
+            length = min(len(upper_code), CODE_GRAM_LENGTH)
+            return {upper_code[start:start + length] for start in range(len(upper_code) - length + 1)}
+        grams = set()
+        for length in range(1, CODE_GRAM_LENGTH + 1):
+            for start in range(len(upper_code) - length + 1):
+                grams.add(upper_code[start:start + length])
+        return grams
+
+    # The entries of a sorted open_codes list starting with needle, in order
+    def _prefix_matches(self, bucket, needle):
+        position = bisect.bisect_left(bucket, (needle,))
+        while position < len(bucket) and bucket[position][0].startswith(needle):
+            yield bucket[position]
+            position += 1
+
+    # Does the game match all given criteria? Same criteria as search, but for one game.
+    def matches(self, doc_id, status=None, group_pass=None, group_passes=None, participant=None):
+        code, game_status, game_group_pass, users = self.indexed[doc_id]
+        if status is not None and game_status != status:
+            return False
+        if group_pass is not None and game_group_pass != group_pass:
+            return False
+        if group_passes is not None and game_group_pass not in group_passes:
+            return False
+        if participant is not None and participant not in users:
+            return False
+        return True
+
+    # The doc_ids matching all given criteria. group_passes is a list of allowed group passes.
+    def search(self, status=None, group_pass=None, group_passes=None, participant=None):
+        candidates = []
+        if status is not None:
+            candidates.append(self.by_status.get(status, set()))
+        if group_pass is not None:
+            candidates.append(self.by_group_pass.get(group_pass, set()))
+        if group_passes is not None:
+            candidates.append(set().union(*[self.by_group_pass.get(allowed_group_pass, set()) for allowed_group_pass in group_passes]))
+        if participant is not None:
+            candidates.append(self.by_user.get(participant, set()))
+        if not candidates:
+            return sorted(self.indexed.keys())
+        # Intersect starting with the smallest set, that keeps the work small
+        candidates.sort(key=len)
+        doc_ids = set(candidates[0])
+        for other in candidates[1:]:
+            doc_ids &= other
+        return sorted(doc_ids)
+
+# Open games ordered by their last activity, oldest first. Kept up to date on every game change,
+# so game lists walk it in the order they show games and stop once they have enough, instead of sorting all open games every time.
+# Lists of one group pass, of one server and the games staying on one server walk their own order, so they cost as much as they have games.
+class ActivityIndex:
+    def __init__(self):
+        # Sorted list of (last activity, doc_id) of all open games
+        self.entries = []
+        # group pass -> sorted list of (last activity, doc_id) of the open games with it
+        self.by_group_pass = {}
+        # host server -> sorted list of (last activity, doc_id) of the open games hosted there
+        self.by_host_server = {}
+        # host server -> sorted list of (last activity, doc_id) of the open games which want to stay on it
+        self.server_only_by_server = {}
+        # doc_id -> (last activity, group pass, host server, server only) as currently indexed
+        self.indexed = {}
+
+    def load(self, games):
+        for entry in games:
+            self.update(entry)
+        logging.info("ActivityIndex: Indexed " + str(len(self.entries)) + " open games.")
+
+    # Adds, moves or removes a game after a change. Expects the full Game.
+    def update(self, entry):
+        new_values = None
+        if entry.status == "open" and entry.turns:
+            new_values = (entry.last_activity, entry.group_pass, entry.host_server, entry.server_only)
+        if self.indexed.get(entry.doc_id) == new_values:
+            return
+        self.remove(entry.doc_id)
+        if new_values is None:
+            return
+        last_activity, group_pass, host_server, server_only = new_values
+        self.indexed[entry.doc_id] = new_values
+        position = (last_activity, entry.doc_id)
+        bisect.insort(self.entries, position)
+        bisect.insort(self.by_group_pass.setdefault(group_pass, []), position)
+        bisect.insort(self.by_host_server.setdefault(host_server, []), position)
+        if server_only:
+            bisect.insort(self.server_only_by_server.setdefault(host_server, []), position)
+
+    def remove(self, doc_id):
+        old_values = self.indexed.pop(doc_id, None)
+        if old_values is None:
+            return
+        last_activity, group_pass, host_server, server_only = old_values
+        position = (last_activity, doc_id)
+        self._remove_position(self.entries, position)
+        self._remove_position(self.by_group_pass, position, group_pass)
+        self._remove_position(self.by_host_server, position, host_server)
+        if server_only:
+            self._remove_position(self.server_only_by_server, position, host_server)
+
+    # Without key, removes the position from the list entries. With key, from the list under key in the dict entries, dropping the list once it is empty.
+    def _remove_position(self, entries, position, key=None):
+        if key is None:
+            del entries[bisect.bisect_left(entries, position)]
+            return
+        sorted_entries = entries[key]
+        del sorted_entries[bisect.bisect_left(sorted_entries, position)]
+        if not sorted_entries:
+            del entries[key]
+
+    # Yields the doc_ids one by one, oldest first or with reverse newest first.
+    # after is a (last activity, doc_id) position to continue behind, in walking direction.
+    # group_pass walks only the games with this group pass, host_server only the games hosted on this server,
+    # server_only_host only the games which want to stay on this server.
+    # Given more than one, the shortest of these lists is walked and the caller filters the rest,
+    # like walk_open_games does with GameIndex.matches and render_game_page with its server checks.
+    # Changes while walking are fine, the walk continues behind the last position it yielded.
+    def walk(self, reverse=False, after=None, group_pass=None, host_server=None, server_only_host=None):
+        position = after
+        while True:
+            # Looked up again every step, a list is replaced when it runs empty and comes back
+            candidates = [self.entries]
+            if server_only_host is not None:
+                candidates.append(self.server_only_by_server.get(server_only_host, []))
+            if host_server is not None:
+                candidates.append(self.by_host_server.get(host_server, []))
+            if group_pass is not None:
+                candidates.append(self.by_group_pass.get(group_pass, []))
+            entries = min(candidates, key=len)
+            if reverse:
+                if position is None:
+                    index = len(entries) - 1
+                else:
+                    index = bisect.bisect_left(entries, position) - 1
+                if index < 0:
+                    return
+            else:
+                if position is None:
+                    index = 0
+                else:
+                    index = bisect.bisect_right(entries, position)
+                if index >= len(entries):
+                    return
+            position = entries[index]
+            yield position[1]
+
+    # The open games among doc_ids in the order walk would yield them, for lists which GameIndex.search narrows down
+    # to a few games anyway, like the games of one user. Same arguments as walk, but host_server and server_only_host are checked exactly.
+    def order(self, doc_ids, reverse=False, after=None, host_server=None, server_only_host=None):
+        positions = []
+        for doc_id in doc_ids:
+            values = self.indexed.get(doc_id)
+            if values is None:
+                continue
+            last_activity, group_pass, game_host_server, server_only = values
+            if host_server is not None and game_host_server != host_server:
+                continue
+            if server_only_host is not None and not (server_only and game_host_server == server_only_host):
+                continue
+            position = (last_activity, doc_id)
+            if after is not None and ((reverse and position >= after) or (not reverse and position <= after)):
+                continue
+            positions.append(position)
+        positions.sort(reverse=reverse)
+        return [doc_id for last_activity, doc_id in positions]
+
+# In-memory lookup tables over all pinboards, so a game change finds the pinboards showing it without scanning all of them
+class PinboardIndex:
+    def __init__(self):
+        # group pass -> doc_ids of pinboards which show games from all servers
+        self.public = {}
+        # server id -> group pass -> doc_ids of all pinboards on this server
+        self.by_server = {}
+        # doc_id -> (group_pass, server_only, server_id, channel) as currently indexed
+        self.indexed = {}
+
+    def load(self, pinboards):
+        for pinboard in pinboards:
+            self.update(pinboard)
+        logging.info("PinboardIndex: Indexed " + str(len(self.indexed)) + " pinboards.")
+
+    # Adds a new pinboard or re-indexes a changed one. Expects the full pinboard document.
+    def update(self, pinboard):
+        doc_id = pinboard.doc_id
+        new_values = (pinboard.get("pinboards_group_pass") or "", bool(pinboard.get("pinboards_server_only")), pinboard.get("pinboards_server_id") or "", pinboard.get("pinboards_channel"))
+        if self.indexed.get(doc_id) == new_values:
+            return
+        self.remove(doc_id)
+
+        group_pass, server_only, server_id, channel = new_values
+        self.indexed[doc_id] = new_values
+        if not server_only:
+            self.public.setdefault(group_pass, set()).add(doc_id)
+        self.by_server.setdefault(server_id, {}).setdefault(group_pass, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        old_values = self.indexed.pop(doc_id, None)
+        if not old_values:
+            return
+        group_pass, server_only, server_id, channel = old_values
+        if not server_only:
+            self.public[group_pass].discard(doc_id)
+            if not self.public[group_pass]:
+                del self.public[group_pass]
+        server_group_passes = self.by_server[server_id]
+        server_group_passes[group_pass].discard(doc_id)
+        if not server_group_passes[group_pass]:
+            del server_group_passes[group_pass]
+        if not server_group_passes:
+            del self.by_server[server_id]
+
+    def channel_of(self, doc_id):
+        return self.indexed[doc_id][3]
+
+    # Same results as the search_pinboards of the storage: Pinboards with this group pass which can be seen from visible_from_server,
+    # optionally only the ones on only_server_id.
+    def search(self, group_pass, visible_from_server="", only_server_id=None):
+        group_pass = group_pass or ""
+        if only_server_id is not None:
+            doc_ids = self.by_server.get(only_server_id, {}).get(group_pass, set())
+            if only_server_id != visible_from_server:
+                # Server only pinboards of another server can't see the game
+                doc_ids = [doc_id for doc_id in doc_ids if not self.indexed[doc_id][1]]
+            return sorted(doc_ids)
+        # Public pinboards everywhere, and all pinboards of the server itself
+        doc_ids = self.public.get(group_pass, set()) | self.by_server.get(visible_from_server, {}).get(group_pass, set())
+        return sorted(doc_ids)
+
+# In-memory copy of the user settings, with the active notification subscriptions indexed like the pinboards.
+# Finding who to notify about a new game is then a union of two small sets instead of a scan over all users.
+class SubscriberIndex:
+    def __init__(self):
+        # user id -> user config document, active or not
+        self.configs = {}
+        # group pass -> user ids of active subscribers who want games from all servers
+        self.public = {}
+        # server id -> group pass -> user ids of all active subscribers with this home server
+        self.by_server = {}
+        # user id -> (group_pass, server_only, server_id) of active subscriptions as currently indexed
+        self.indexed = {}
+
+    def load(self, user_configs):
+        for user_config in user_configs:
+            self.update(user_config)
+        logging.info("SubscriberIndex: Loaded " + str(len(self.configs)) + " user configs, " + str(len(self.indexed)) + " with active notifications.")
+
+    # The settings of a user, or None
+    def get(self, user_id):
+        return self.configs.get(str(user_id))
+
+    # Adds new or changed settings. Expects the full user config document.
+    def update(self, user_config):
+        user_id = str(user_config.get("user"))
+        self.configs[user_id] = user_config
+        new_values = None
+        if user_config.get("notifications_active"):
+            new_values = (user_config.get("notifications_group_pass") or "", bool(user_config.get("notifications_server_only")), user_config.get("notifications_server_id") or "")
+        if self.indexed.get(user_id) == new_values:
+            return
+        self._unindex(user_id)
+        if new_values is None:
+            return
+
+        group_pass, server_only, server_id = new_values
+        self.indexed[user_id] = new_values
+        if not server_only:
+            self.public.setdefault(group_pass, set()).add(user_id)
+        self.by_server.setdefault(server_id, {}).setdefault(group_pass, set()).add(user_id)
+
+    def _unindex(self, user_id):
+        old_values = self.indexed.pop(user_id, None)
+        if not old_values:
+            return
+        group_pass, server_only, server_id = old_values
+        if not server_only:
+            self.public[group_pass].discard(user_id)
+            if not self.public[group_pass]:
+                del self.public[group_pass]
+        server_group_passes = self.by_server[server_id]
+        server_group_passes[group_pass].discard(user_id)
+        if not server_group_passes[group_pass]:
+            del server_group_passes[group_pass]
+        if not server_group_passes:
+            del self.by_server[server_id]
+
+    # Same results as the search_notification_subscribers of the storage, ordered by doc_id
+    def search(self, group_pass, visible_from_server="", only_server_id=None):
+        group_pass = group_pass or ""
+        if only_server_id is not None:
+            user_ids = self.by_server.get(only_server_id, {}).get(group_pass, set())
+            if only_server_id != visible_from_server:
+                user_ids = [user_id for user_id in user_ids if not self.indexed[user_id][1]]
+        else:
+            user_ids = self.public.get(group_pass, set()) | self.by_server.get(visible_from_server, {}).get(group_pass, set())
+        return sorted((self.configs[user_id] for user_id in user_ids), key=lambda user_config: user_config.doc_id)
+
+# The group passes each user used lately, most recent last. Feeds the group pass autocomplete.
+# A group pass counts for a user as long as one of the users games with it is not abandoned, at runtime the same way as after a restart.
+class GroupPassHistory:
+    def __init__(self, max_per_user=25):
+        self.max_per_user = max_per_user
+        # user id -> OrderedDict of group pass -> None
+        self.by_user = {}
+        # doc_id -> (group pass, users) of the games which count
+        self.games = {}
+        # (user id, group pass) -> number of games which count for it
+        self.game_counts = {}
+
+    # Replays all turns in games with a group pass, oldest first. Abandoned games don't count.
+    def load(self, games):
+        turns = []
+        for entry in games:
+            self._count(entry)
+            if entry.group_pass and entry.status != "abandoned":
+                for turn in entry.turns:
+                    turns.append((turn.timestamp, turn.user, entry.group_pass))
+        for timestamp, user_id, group_pass in sorted(turns):
+            self.touch(user_id, group_pass)
+        logging.info("GroupPassHistory: Loaded group passes of " + str(len(self.by_user)) + " users.")
+
+    # A game was added or changed. Users who count for its group pass just now used it, users of abandoned games lose it.
+    def update(self, entry):
+        for user_id in self._count(entry):
+            self.touch(user_id, entry.group_pass)
+
+    # Updates which games count for which users. Returns the users who count for the group pass of the game now but did not before.
+    def _count(self, entry):
+        users = frozenset()
+        if entry.group_pass and entry.status != "abandoned":
+            users = entry.participants
+        old_group_pass, old_users = self.games.get(entry.doc_id, ("", frozenset()))
+        if users:
+            self.games[entry.doc_id] = (entry.group_pass, users)
+        else:
+            self.games.pop(entry.doc_id, None)
+        old_pairs = {(user_id, old_group_pass) for user_id in old_users}
+        new_pairs = {(user_id, entry.group_pass) for user_id in users}
+        for pair in old_pairs - new_pairs:
+            self.game_counts[pair] -= 1
+            if not self.game_counts[pair]:
+                del self.game_counts[pair]
+                self._forget(*pair)
+        for pair in new_pairs - old_pairs:
+            self.game_counts[pair] = self.game_counts.get(pair, 0) + 1
+        return [user_id for user_id, group_pass in new_pairs - old_pairs]
+
+    def _forget(self, user_id, group_pass):
+        group_passes = self.by_user.get(str(user_id))
+        if group_passes is None:
+            return
+        group_passes.pop(group_pass, None)
+        if not group_passes:
+            del self.by_user[str(user_id)]
+
+    # The user just used this group pass
+    def touch(self, user_id, group_pass):
+        if not group_pass:
+            return
+        group_passes = self.by_user.setdefault(str(user_id), collections.OrderedDict())
+        group_passes[group_pass] = None
+        group_passes.move_to_end(group_pass)
+        while len(group_passes) > self.max_per_user:
+            group_passes.popitem(last=False)
+
+    # The group passes of the user, most recent first
+    def recent(self, user_id):
+        return list(reversed(self.by_user.get(str(user_id), ())))
+
+# Min-heap of open games by the time they expire. Changed deadlines are pushed again, the outdated heap entries are skipped when they come up.
+class ExpiryQueue:
+    def __init__(self):
+        self.heap = []
+        # doc_id -> current deadline
+        self.deadlines = {}
+        # Set whenever a deadline comes up that is earlier than everything before, so a sleeping purge task wakes up
+        self.wakeup = asyncio.Event()
+
+    # Sets the deadline of a game. None removes the game from the queue.
+    def update(self, doc_id, deadline):
+        if deadline is None:
+            self.deadlines.pop(doc_id, None)
+            return
+        if self.deadlines.get(doc_id) == deadline:
+            return
+        earliest = self.next_deadline()
+        self.deadlines[doc_id] = deadline
+        heapq.heappush(self.heap, (deadline, doc_id))
+        # Too many outdated entries? Rebuild the heap from the current deadlines.
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(game_deadline, game_doc_id) for game_doc_id, game_deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+        if earliest is None or deadline < earliest:
+            self.wakeup.set()
+
+    # Drops heap entries whose game got a new deadline or left the queue
+    def _drop_outdated(self):
+        while self.heap:
+            deadline, doc_id = self.heap[0]
+            if self.deadlines.get(doc_id) == deadline:
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        self._drop_outdated()
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    # Removes and returns all games whose deadline has passed
+    def pop_due(self, now):
+        due = []
+        self._drop_outdated()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, doc_id = heapq.heappop(self.heap)
+            del self.deadlines[doc_id]
+            due.append(doc_id)
+            self._drop_outdated()
+        return due
@@ -0,0 +1,87 @@
+import collections
+import json
+import logging
+import interactions
+from interactions import SelectMenu, SelectOption
+
+# Everything about one map, prepared once when the bot starts.
+# emoji_string: The map emoji for message texts, "" if there is none. emoji: The same emoji as object for select menus, or None.
+# label and description: Ready for the map select menu. rewards: (emoji string, reward) pairs.
+# embed_description: The map part of a game embed: map, turns and rewards.
+MapInfo = collections.namedtuple("MapInfo", ["map_id", "name", "difficulty", "maxturns", "maxplayers", "possible_rewards",
+                                             "emoji_string", "emoji", "label", "description", "rewards", "embed_description"])
+
+# Turns "<:map1:1068700386753511534>" into an emoji object. None if the string is no custom emoji.
+def parse_emoji(emoji_string):
+    parts = emoji_string.strip("<>").split(":")
+    if len(parts) != 3 or not parts[2]:
+        return None
+    return interactions.Emoji(id=parts[2], name=parts[1], animated=(parts[0] == "a"))
+
+# All maps and their emoji. Index = Map number, like in mapdata.json the first entry is always blank.
+class MapCatalog:
+    def __init__(self, mapdata_path="ressources/mapdata.json", emoji_path="ressources/emoji.json"):
+        with open(mapdata_path, "r") as json_file:
+            mapdata = json.load(json_file)
+        with open(emoji_path, "r") as json_file:
+            self.emoji = json.load(json_file)
+
+        self.maps = [None]
+        for map_id, mapinfo in enumerate(mapdata):
+            if map_id == 0:
+                continue
+            self.maps.append(self._compile(map_id, mapinfo))
+
+        # The options of the map select menu never change, so they are built only once
+        self.select_options = []
+        for map_info in self.maps[1:26]:
+            self.select_options.append(SelectOption(label=map_info.label,
+                                                    value=map_info.map_id,
+                                                    description=map_info.description,
+                                                    emoji=map_info.emoji
+                                                    )
+                                                )
+        logging.info("MapCatalog: Loaded " + str(len(self.maps) - 1) + " maps")
+
+    def _compile(self, map_id, mapinfo):
+        name = mapinfo["name"]
+        difficulty = mapinfo["difficulty"]
+        maxturns = mapinfo["maxturns"]
+        maxplayers = mapinfo["maxplayers"]
+        possible_rewards = tuple(mapinfo["possible_rewards"])
+        emoji_string = self.emoji.get("map" + str(map_id), "")
+        rewards = tuple((self.emoji.get(reward.lower().split()[0], ""), reward) for reward in possible_rewards)
+
+        # First line: Map. Second line: Turns. Remaining lines: Rewards
+        embed_description = emoji_string + " " + name + "(" + difficulty + ")"
+        embed_description += "\nTurns: " + str(maxturns) + " (" + str(maxplayers) + " players)"
+        embed_description += "\nReward:"
+        for reward_emoji, reward in rewards:
+            embed_description += "\n" + reward_emoji + " " + reward
+
+        return MapInfo(map_id=map_id,
+                       name=name,
+                       difficulty=difficulty,
+                       maxturns=maxturns,
+                       maxplayers=maxplayers,
+                       possible_rewards=possible_rewards,
+                       emoji_string=emoji_string,
+                       emoji=parse_emoji(emoji_string),
+                       label=name + "(" + difficulty + ")",
+                       description=str("Turns: " + str(maxturns) + " Players: " + str(maxplayers) + " Rewards: " + ",".join(possible_rewards))[:100],
+                       rewards=rewards,
+                       embed_description=embed_description)
+
+    # Select menu for new games. The custom_id carries the new game, so only the menu around the options is new every time.
+    def select_menu(self, custom_id):
+        return SelectMenu(
+                    custom_id=custom_id,
+                    placeholder="Select map for new game",
+                    options=self.select_options,
+                )
+
+    def is_known(self, map_id):
+        return 1 <= map_id < len(self.maps)
+
+    def get(self, map_id):
+        return self.maps[map_id]
@@ -0,0 +1,156 @@
+import datetime
+
+# All timestamps are whole microseconds since 1970-01-01 UTC.
+# The ISO strings we stored before are utcnow().isoformat(), which never holds more than microseconds, so converting them is lossless.
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROS_PER_DAY = 86400 * 1000000
+
+# Accepts microseconds, an ISO string like "2023-02-01T16:59:00.123456" or a datetime. Naive values are UTC.
+def to_micros(timestamp):
+    if isinstance(timestamp, int):
+        return timestamp
+    if not isinstance(timestamp, datetime.datetime):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def now_micros():
+    return to_micros(datetime.datetime.utcnow())
+
+# Naive UTC datetime, like utcnow() gives
+def micros_to_datetime(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+def micros_to_iso(micros):
+    return micros_to_datetime(micros).isoformat()
+
+def timedelta_to_micros(delta):
+    return delta // datetime.timedelta(microseconds=1)
+
+# Whole seconds, as discord wants them for <t:...:R>
+def micros_to_unix(micros):
+    return micros // 1000000
+
+# One turn of a game. Turns never change once they are made, a changed turn is a new Turn object, so games can share them.
+class Turn:
+    __slots__ = ("user", "server", "timestamp")
+
+    def __init__(self, user, server="", timestamp=None):
+        self.user = str(user)
+        self.server = str(server or "")
+        if timestamp is None:
+            timestamp = now_micros()
+        self.timestamp = to_micros(timestamp)
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(value["user"], value.get("server", ""), value["timestamp"])
+
+    def to_dict(self):
+        return {"user" : self.user, "server" : self.server, "timestamp" : self.timestamp}
+
+    # The same turn with a new timestamp
+    def touched(self, timestamp=None):
+        return Turn(self.user, self.server, timestamp)
+
+    def __eq__(self, other):
+        return isinstance(other, Turn) and (self.user, self.server, self.timestamp) == (other.user, other.server, other.timestamp)
+
+    def __repr__(self):
+        return "Turn(" + self.user + ", " + self.server + ", " + str(self.timestamp) + ")"
+
+# Turns from callers and old storage come as dicts, new ones as Turn
+def as_turn(turn):
+    if isinstance(turn, Turn):
+        return turn
+    return Turn.from_dict(turn)
+
+# A game as it lives in memory. Host, participants and last activity are worked out once whenever the turns change,
+# so change the turns only through set_turns and add_turn. Deletion votes stay plain {"user", "server"} dicts, they travel in private messages as they are.
+# version counts the changes of the game. The storages raise it with every update, buttons remember it to notice when they are outdated.
+class Game:
+    __slots__ = ("doc_id", "code", "map", "server_only", "group_pass", "status", "turns", "deletion_votes", "version",
+                 "host_user", "host_server", "participants", "last_activity")
+
+    def __init__(self, code, map, server_only=False, group_pass="", status="open", turns=(), deletion_votes=(), doc_id=None, version=0):
+        self.doc_id = doc_id
+        self.version = int(version or 0)
+        self.code = code
+        self.map = map
+        self.server_only = bool(server_only)
+        self.group_pass = group_pass or ""
+        self.status = status
+        self.deletion_votes = [dict(vote) for vote in deletion_votes]
+        self.set_turns(turns)
+
+    # Game documents as TinyDB and the old snapshots had them, ISO timestamps or not
+    @classmethod
+    def from_dict(cls, value, doc_id=None):
+        return cls(code=value.get("code"),
+                   map=value.get("map"),
+                   server_only=value.get("server_only"),
+                   group_pass=value.get("group_pass"),
+                   status=value.get("status"),
+                   turns=value.get("turns", []),
+                   deletion_votes=value.get("deletion_votes", []),
+                   doc_id=doc_id,
+                   version=value.get("version", 0))
+
+    def to_dict(self):
+        return {"code" : self.code,
+                "map" : self.map,
+                "server_only" : self.server_only,
+                "group_pass" : self.group_pass,
+                "status" : self.status,
+                "turns" : [turn.to_dict() for turn in self.turns],
+                "deletion_votes" : [dict(vote) for vote in self.deletion_votes],
+                "version" : self.version}
+
+    # Callers may change what they get, so storages hand out copies. The turns themselves never change and are shared.
+    def copy(self):
+        game = Game.__new__(Game)
+        for name in Game.__slots__:
+            setattr(game, name, getattr(self, name))
+        game.turns = list(self.turns)
+        game.deletion_votes = [dict(vote) for vote in self.deletion_votes]
+        return game
+
+    def set_turns(self, turns):
+        self.turns = [as_turn(turn) for turn in turns]
+        if self.turns:
+            self.host_user = self.turns[0].user
+            self.host_server = self.turns[0].server
+            self.last_activity = self.turns[-1].timestamp
+        else:
+            self.host_user = ""
+            self.host_server = ""
+            self.last_activity = None
+        self.participants = frozenset(turn.user for turn in self.turns)
+
+    def add_turn(self, turn):
+        turn = as_turn(turn)
+        self.turns.append(turn)
+        if len(self.turns) == 1:
+            self.host_user = turn.user
+            self.host_server = turn.server
+        self.last_activity = turn.timestamp
+        self.participants = self.participants | {turn.user}
+
+    # Changes the plain fields and, if given, replaces the turns or deletion votes
+    def apply(self, fields):
+        for name, value in fields.items():
+            if name == "turns":
+                self.set_turns(value)
+            elif name == "deletion_votes":
+                self.deletion_votes = [dict(vote) for vote in value]
+            elif name == "server_only":
+                self.server_only = bool(value)
+            elif name == "group_pass":
+                self.group_pass = value or ""
+            else:
+                setattr(self, name, value)
+
+    def __repr__(self):
+        return "Game(" + str(self.doc_id) + ", " + str(self.code) + ", " + str(self.status) + ", " + str(len(self.turns)) + " turns, version " + str(self.version) + ")"
@@ -0,0 +1,92 @@
+import collections
+import json
+import logging
+import os
+
+# Work the bot still owes somebody, like private messages and pinboard refreshes. Survives restarts.
+# Every item has an idempotency key like "game_finished:<doc_id>:<user>". Putting a key which is still pending does nothing,
+# so the same work is never queued twice. Items are written and fsynced before they are attempted, and marked done afterwards.
+# The file is an append-only list of put and done records. Once it is mostly done records, it gets rewritten with only the pending items.
+class Outbox:
+    def __init__(self, path, compact_after=1000):
+        self.path = path
+        self.compact_after = compact_after
+        # key -> (kind, value), oldest first
+        self.pending = collections.OrderedDict()
+        self.done_records = 0
+        self.outbox_file = None
+        self._load()
+        # Start with a small file, delivered items from the last run are not needed anymore
+        self.compact()
+        logging.info("Outbox: Loaded " + str(len(self.pending)) + " pending items from " + path)
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as outbox_file:
+            for line in outbox_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash in the middle of a write leaves half a line behind. Everything before it is fine.
+                    logging.info("Outbox: Skipping broken line in " + self.path)
+                    continue
+                if record["op"] == "put":
+                    self.pending[record["key"]] = (record["kind"], record["value"])
+                elif record["op"] == "done":
+                    self.pending.pop(record["key"], None)
+
+    def _append(self, records, sync):
+        for record in records:
+            self.outbox_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.outbox_file.flush()
+        if sync:
+            os.fsync(self.outbox_file.fileno())
+
+    # Adds (key, kind, value) items with a single fsync. Returns the keys which were not pending yet.
+    def put_many(self, items):
+        records = []
+        for key, kind, value in items:
+            if key in self.pending:
+                continue
+            self.pending[key] = (kind, value)
+            records.append({"op" : "put", "key" : key, "kind" : kind, "value" : value})
+        if records:
+            self._append(records, sync=True)
+        return [record["key"] for record in records]
+
+    def put(self, key, kind, value):
+        return bool(self.put_many([(key, kind, value)]))
+
+    # Marks an item as delivered, or as given up on. Not fsynced: after a crash the item is simply done once more.
+    def done(self, key):
+        if self.pending.pop(key, None) is None:
+            return
+        self._append([{"op" : "done", "key" : key}], sync=False)
+        self.done_records += 1
+        if self.done_records >= self.compact_after and self.done_records > 2 * len(self.pending):
+            self.compact()
+
+    # The pending items of one kind, oldest first, as (key, value)
+    def pending_items(self, kind):
+        return [(key, value) for key, (item_kind, value) in self.pending.items() if item_kind == kind]
+
+    # Rewrites the file with only the pending items
+    def compact(self):
+        if self.outbox_file:
+            self.outbox_file.close()
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as outbox_file:
+            for key, (kind, value) in self.pending.items():
+                outbox_file.write(json.dumps({"op" : "put", "key" : key, "kind" : kind, "value" : value}, separators=(",", ":")) + "\n")
+            outbox_file.flush()
+            os.fsync(outbox_file.fileno())
+        os.replace(temporary_path, self.path)
+        self.outbox_file = open(self.path, "a", encoding="utf-8")
+        self.done_records = 0
+
+    def close(self):
+        self.outbox_file.close()
+
+    def stats(self):
+        return "Outbox: " + str(len(self.pending)) + " pending, " + str(self.done_records) + " done since the last compaction"
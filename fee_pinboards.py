@@ -0,0 +1,124 @@
+import asyncio
+import collections
+import logging
+import time
+
+# Collects pinboards which need a refresh and refreshes them in the background.
+# Changes only mark pinboards dirty. The first mark starts a debounce window, at the end of the window
+# every dirty pinboard is refreshed once with whatever the games look like by then.
+# Refreshes run at the same time, at most concurrency of them and only one per channel.
+# Dirty pinboards are kept in the outbox until they are refreshed, so a restart does not lose them.
+class PinboardRefreshQueue:
+    def __init__(self, refresh, outbox, debounce=5.0, concurrency=5):
+        # Coroutine function which gets a pinboard doc_id and brings the pinboard message up to date. Returns what it did, like "edited" or "unchanged".
+        self.refresh = refresh
+        self.outbox = outbox
+        self.debounce = debounce
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # channel id -> lock, so a channel never has two refreshes in flight
+        self.channel_locks = {}
+        # doc_id -> channel id of pinboards waiting for the next flush
+        self.dirty = {}
+        # doc_id -> seconds the last refresh of this pinboard took
+        self.durations = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.marked = 0
+        # Outcome of the refreshes, for example how many edits were skipped because nothing changed
+        self.outcomes = collections.Counter()
+
+    # Starts refreshing, beginning with the pinboards the last run did not refresh anymore
+    def start(self):
+        if not self.task:
+            undelivered = self.outbox.pending_items("pinboard")
+            for key, value in undelivered:
+                self.dirty[value["doc_id"]] = value["channel_id"]
+            if self.dirty:
+                logging.info("PinboardRefreshQueue: Continuing with " + str(len(self.dirty)) + " pinboards left from the last run")
+                self.wakeup.set()
+            self.task = asyncio.get_event_loop().create_task(self.flush_loop())
+
+    # Marks pinboards for the next refresh. Marking one several times in the same window refreshes it only once.
+    # Expects (doc_id, channel id) pairs.
+    def mark_dirty(self, pinboards):
+        items = []
+        for doc_id, channel_id in pinboards:
+            self.marked += 1
+            self.dirty[doc_id] = channel_id
+            items.append(("pinboard:" + str(doc_id), "pinboard", {"doc_id" : doc_id, "channel_id" : channel_id}))
+        self.outbox.put_many(items)
+        if self.dirty:
+            self.wakeup.set()
+
+    async def flush_loop(self):
+        while True:
+            await self.wakeup.wait()
+            # Give the other changes of the rush a chance to come in
+            await asyncio.sleep(self.debounce)
+            self.wakeup.clear()
+            await self.flush()
+
+    # Refreshes everything dirty right now. Pinboards marked during the flush wait for the next window.
+    async def flush(self):
+        dirty = self.dirty
+        self.dirty = {}
+        if not dirty:
+            return
+        started = time.monotonic()
+        await asyncio.gather(*[self.refresh_one(doc_id, channel_id) for doc_id, channel_id in sorted(dirty.items())])
+        logging.info("PinboardRefreshQueue: Refreshed " + str(len(dirty)) + " pinboards in " + str(round(time.monotonic() - started, 2)) + "s. " + self.stats())
+
+    async def refresh_one(self, doc_id, channel_id):
+        # There is at most one pinboard per channel, so the locks never outnumber the pinboards
+        lock = self.channel_locks.setdefault(channel_id, asyncio.Lock())
+        async with self.semaphore:
+            async with lock:
+                started = time.monotonic()
+                try:
+                    outcome = await self.refresh(doc_id)
+                except Exception as e:
+                    outcome = "failed"
+                    logging.info("PinboardRefreshQueue: Refreshing pinboard " + str(doc_id) + " failed, " + str(e))
+                self.outcomes[outcome] += 1
+                # Unless it got dirty again in the meantime, the pinboard is up to date now
+                if doc_id not in self.dirty:
+                    self.outbox.done("pinboard:" + str(doc_id))
+                self.durations[doc_id] = time.monotonic() - started
+                logging.info("PinboardRefreshQueue: Pinboard " + str(doc_id) + " in channel " + str(channel_id) + " took " + str(round(self.durations[doc_id], 2)) + "s")
+
+    def stats(self):
+        durations = sorted(self.durations.values())
+        text = "PinboardRefreshQueue: " + str(len(self.dirty)) + " dirty, " + str(self.marked) + " marked, " + str(dict(self.outcomes))
+        if durations:
+            median = durations[len(durations) // 2]
+            text += ", last refresh per pinboard median " + str(round(median, 2)) + "s, slowest " + str(round(durations[-1], 2)) + "s"
+        return text
+
+# Counts the messages posted in pinboard channels after the pinboard message, from the message events of the gateway.
+# That tells us when a pinboard got buried and needs to be posted again, without asking discord for the channel history.
+# Messages posted while the bot was offline are not counted, the age check of the pinboard catches those boards eventually.
+class PinboardChannelActivity:
+    def __init__(self):
+        # channel id -> [pinboard message id, messages posted after it]
+        self.channels = {}
+
+    # Starts counting again after the given pinboard message
+    def watch(self, channel_id, message_id):
+        self.channels[str(channel_id)] = [int(message_id), 0]
+
+    def forget(self, channel_id):
+        self.channels.pop(str(channel_id), None)
+
+    def message_created(self, channel_id, message_id):
+        channel = self.channels.get(str(channel_id))
+        if channel and int(message_id) > channel[0]:
+            channel[1] += 1
+
+    # Messages posted after the pinboard message
+    def messages_after(self, channel_id, message_id):
+        channel = self.channels.get(str(channel_id))
+        if channel is None or channel[0] != int(message_id):
+            # Not watched yet, so start now
+            self.watch(channel_id, message_id)
+            return 0
+        return channel[1]
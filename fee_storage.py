@@ -0,0 +1,842 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from fee_models import Game, Turn, as_turn, to_micros
+
+# A stored pinboard or user config. Behaves like the plain dict we put in, but remembers where it lives in the database. Games are Game objects.
+class Document(dict):
+    def __init__(self, value, doc_id):
+        super().__init__(value)
+        self.doc_id = doc_id
+
+# Database layout. Games keep the columns we search for as real, indexed columns.
+# Turns and deletion votes are child tables so adding one does not rewrite the whole game.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    doc_id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    map INTEGER,
+    server_only INTEGER NOT NULL DEFAULT 0,
+    group_pass TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'open',
+    host_user TEXT NOT NULL DEFAULT '',
+    host_server TEXT NOT NULL DEFAULT '',
+    last_activity INTEGER,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS games_code_status ON games (code, status);
+CREATE INDEX IF NOT EXISTS games_status_last_activity ON games (status, last_activity);
+CREATE INDEX IF NOT EXISTS games_group_pass_status ON games (group_pass, status);
+CREATE INDEX IF NOT EXISTS games_server_only_host_server ON games (server_only, host_server);
+CREATE INDEX IF NOT EXISTS games_host_server ON games (host_server);
+CREATE INDEX IF NOT EXISTS games_last_activity ON games (last_activity);
+
+CREATE TABLE IF NOT EXISTS turns (
+    doc_id INTEGER NOT NULL REFERENCES games (doc_id) ON DELETE CASCADE,
+    turn INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    server TEXT NOT NULL DEFAULT '',
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (doc_id, turn)
+);
+CREATE INDEX IF NOT EXISTS turns_user ON turns (user, doc_id);
+
+CREATE TABLE IF NOT EXISTS deletion_votes (
+    doc_id INTEGER NOT NULL REFERENCES games (doc_id) ON DELETE CASCADE,
+    vote INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    server TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (doc_id, vote)
+);
+
+CREATE TABLE IF NOT EXISTS pinboards (
+    doc_id INTEGER PRIMARY KEY,
+    pinboards_channel TEXT NOT NULL,
+    pinboards_message TEXT NOT NULL,
+    pinboards_server_only INTEGER NOT NULL DEFAULT 0,
+    pinboards_server_id TEXT NOT NULL DEFAULT '',
+    pinboards_group_pass TEXT NOT NULL DEFAULT '',
+    pinboards_hash TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS pinboards_channel ON pinboards (pinboards_channel);
+CREATE INDEX IF NOT EXISTS pinboards_group_pass_server_id ON pinboards (pinboards_group_pass, pinboards_server_id);
+
+CREATE TABLE IF NOT EXISTS user_config (
+    doc_id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL UNIQUE,
+    notifications_active INTEGER NOT NULL DEFAULT 0,
+    notifications_server_only INTEGER NOT NULL DEFAULT 0,
+    notifications_server_id TEXT NOT NULL DEFAULT '',
+    notifications_group_pass TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS user_config_notifications ON user_config (notifications_active, notifications_group_pass, notifications_server_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns of the games table which are fields of the Game. The others are derived from the turns. Timestamps are microseconds since 1970 UTC.
+# The version column is not among them, callers can't set it. Every update raises it by one.
+GAME_COLUMNS = ["code", "map", "server_only", "group_pass", "status"]
+PINBOARD_COLUMNS = ["pinboards_channel", "pinboards_message", "pinboards_server_only", "pinboards_server_id", "pinboards_group_pass", "pinboards_hash"]
+USER_CONFIG_COLUMNS = ["user", "notifications_active", "notifications_server_only", "notifications_server_id", "notifications_group_pass"]
+BOOLEAN_COLUMNS = ["server_only", "pinboards_server_only", "notifications_active", "notifications_server_only"]
+
+# SQLite storage for games, pinboards and user settings
+class SqliteStorage:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        # WAL lets us append small changes instead of rewriting pages all over the file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+        logging.info("SqliteStorage: Opened database " + path)
+
+    def close(self):
+        self.connection.close()
+
+    # CREATE TABLE IF NOT EXISTS leaves older tables alone, so columns added later have to be added here too
+    def _migrate(self):
+        pinboard_columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(pinboards)")]
+        if "pinboards_hash" not in pinboard_columns:
+            logging.info("SqliteStorage: Adding column pinboards_hash")
+            with self.connection:
+                self.connection.execute("ALTER TABLE pinboards ADD COLUMN pinboards_hash TEXT NOT NULL DEFAULT ''")
+        game_columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(games)")]
+        if "version" not in game_columns:
+            logging.info("SqliteStorage: Adding column version")
+            with self.connection:
+                self.connection.execute("ALTER TABLE games ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        turn_columns = {row["name"] : row["type"] for row in self.connection.execute("PRAGMA table_info(turns)")}
+        if turn_columns["timestamp"] == "TEXT":
+            self._migrate_timestamps()
+
+    # Timestamps used to be ISO strings. SQLite can't change a column type, so games and turns are rebuilt with integer timestamps.
+    def _migrate_timestamps(self):
+        logging.info("SqliteStorage: Converting timestamps to microseconds")
+        games = self.connection.execute("SELECT * FROM games").fetchall()
+        turns = self.connection.execute("SELECT * FROM turns").fetchall()
+        # Dropping the games would take their turns and votes along otherwise
+        self.connection.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.execute("DROP TABLE turns")
+                self.connection.execute("DROP TABLE games")
+                for statement in SCHEMA.split(";"):
+                    if statement.strip():
+                        self.connection.execute(statement)
+                for game in games:
+                    row = dict(game)
+                    row["last_activity"] = to_micros(row["last_activity"]) if row["last_activity"] else None
+                    self.connection.execute("INSERT INTO games (" + ", ".join(row.keys()) + ") VALUES (" + ",".join("?" * len(row)) + ")", list(row.values()))
+                self.connection.executemany("INSERT INTO turns (doc_id, turn, user, server, timestamp) VALUES (?, ?, ?, ?, ?)",
+                                            [(turn["doc_id"], turn["turn"], turn["user"], turn["server"], to_micros(turn["timestamp"])) for turn in turns])
+        finally:
+            self.connection.execute("PRAGMA foreign_keys=ON")
+        logging.info("SqliteStorage: Converted " + str(len(games)) + " games and " + str(len(turns)) + " turns")
+
+    # SQLite does its own syncing, nothing to run in the background
+    def start_background_tasks(self):
+        pass
+
+    # Turns a row into a plain dict with python booleans
+    def _row_to_dict(self, row, columns):
+        value = {}
+        for column in columns:
+            value[column] = row[column]
+            if column in BOOLEAN_COLUMNS:
+                value[column] = bool(value[column])
+        return value
+
+    # Builds full games with turns and deletion votes for the given game rows
+    def _build_games(self, rows):
+        if not rows:
+            return []
+        games = {}
+        turns = {}
+        votes = {}
+        for row in rows:
+            games[row["doc_id"]] = self._row_to_dict(row, GAME_COLUMNS)
+            games[row["doc_id"]]["version"] = row["version"]
+            turns[row["doc_id"]] = []
+            votes[row["doc_id"]] = []
+
+        # Fetch the children of many games at once instead of one query per game. Chunked to stay below the SQLite variable limit.
+        all_doc_ids = list(games.keys())
+        for chunk_start in range(0, len(all_doc_ids), 500):
+            doc_ids = all_doc_ids[chunk_start:chunk_start + 500]
+            placeholders = ",".join("?" * len(doc_ids))
+            for turn in self.connection.execute("SELECT doc_id, user, server, timestamp FROM turns WHERE doc_id IN (" + placeholders + ") ORDER BY doc_id, turn", doc_ids):
+                turns[turn["doc_id"]].append(Turn(turn["user"], turn["server"], turn["timestamp"]))
+            for vote in self.connection.execute("SELECT doc_id, user, server FROM deletion_votes WHERE doc_id IN (" + placeholders + ") ORDER BY doc_id, vote", doc_ids):
+                votes[vote["doc_id"]].append({"user" : vote["user"], "server" : vote["server"]})
+        return [Game(turns=turns[doc_id], deletion_votes=votes[doc_id], doc_id=doc_id, **game) for doc_id, game in games.items()]
+
+    # Host and last activity are stored next to the game so they can be indexed
+    def _derived_game_columns(self, game):
+        return {"host_user" : game.host_user, "host_server" : game.host_server, "last_activity" : game.last_activity}
+
+    def _write_turns(self, doc_id, turns, first_turn=0):
+        self.connection.executemany("INSERT INTO turns (doc_id, turn, user, server, timestamp) VALUES (?, ?, ?, ?, ?)",
+                                    [(doc_id, first_turn + index, turn.user, turn.server, turn.timestamp) for index, turn in enumerate(turns)])
+
+    def _write_deletion_votes(self, doc_id, deletion_votes, first_vote=0):
+        self.connection.executemany("INSERT INTO deletion_votes (doc_id, vote, user, server) VALUES (?, ?, ?, ?)",
+                                    [(doc_id, first_vote + index, vote["user"], vote.get("server", "")) for index, vote in enumerate(deletion_votes)])
+
+    def _update_row(self, table, doc_id, fields):
+        if not fields:
+            return
+        assignments = ", ".join(column + " = ?" for column in fields.keys())
+        self.connection.execute("UPDATE " + table + " SET " + assignments + " WHERE doc_id = ?", list(fields.values()) + [doc_id])
+
+    # Returns one game or None
+    def get_game(self, doc_id):
+        try:
+            doc_id = int(doc_id)
+        except (TypeError, ValueError):
+            return None
+        rows = self.connection.execute("SELECT * FROM games WHERE doc_id = ?", (doc_id,)).fetchall()
+        games = self._build_games(rows)
+        if games:
+            return games[0]
+        return None
+
+    # Returns the games with the given doc_ids, ordered by doc_id. Unknown doc_ids are skipped.
+    def get_games(self, doc_ids):
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        rows = []
+        for chunk_start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[chunk_start:chunk_start + 500]
+            rows.extend(self.connection.execute("SELECT * FROM games WHERE doc_id IN (" + ",".join("?" * len(chunk)) + ")", chunk).fetchall())
+        rows.sort(key=lambda row: row["doc_id"])
+        return self._build_games(rows)
+
+    # Searches games. Every given criteria must match.
+    # all_turns_on_server: Every turn of the game was made on this server
+    # participant: The user took at least one turn in the game
+    def search_games(self, code=None, codes=None, status=None, not_status=None, group_pass=None, group_passes=None, has_group_pass=None, all_turns_on_server=None, participant=None):
+        conditions = []
+        parameters = []
+        if code is not None:
+            conditions.append("code = ?")
+            parameters.append(code)
+        if codes is not None:
+            if not codes:
+                return []
+            conditions.append("code IN (" + ",".join("?" * len(codes)) + ")")
+            parameters.extend(codes)
+        if status is not None:
+            conditions.append("status = ?")
+            parameters.append(status)
+        if not_status is not None:
+            conditions.append("status != ?")
+            parameters.append(not_status)
+        if group_pass is not None:
+            conditions.append("group_pass = ?")
+            parameters.append(group_pass)
+        if group_passes is not None:
+            conditions.append("group_pass IN (" + ",".join("?" * len(group_passes)) + ")")
+            parameters.extend(group_passes)
+        if has_group_pass is not None:
+            if has_group_pass:
+                conditions.append("group_pass != ''")
+            else:
+                conditions.append("group_pass = ''")
+        if all_turns_on_server is not None:
+            conditions.append("NOT EXISTS (SELECT 1 FROM turns WHERE turns.doc_id = games.doc_id AND turns.server != ?)")
+            parameters.append(all_turns_on_server)
+        if participant is not None:
+            conditions.append("doc_id IN (SELECT doc_id FROM turns WHERE user = ?)")
+            parameters.append(participant)
+
+        query = "SELECT * FROM games"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY doc_id"
+        return self._build_games(self.connection.execute(query, parameters).fetchall())
+
+    # Adds a new game and returns its doc_id. Takes a Game or a plain game document. A doc_id can be given to keep ids from an old database.
+    def insert_game(self, game, doc_id=None):
+        with self.connection:
+            return self._insert_game(game, doc_id)
+
+    def _insert_game(self, game, doc_id=None):
+        if not isinstance(game, Game):
+            game = Game.from_dict(game)
+        row = {column : getattr(game, column) for column in GAME_COLUMNS}
+        row.update(self._derived_game_columns(game))
+        row["version"] = game.version
+        if doc_id is not None:
+            row["doc_id"] = int(doc_id)
+        cursor = self.connection.execute("INSERT INTO games (" + ", ".join(row.keys()) + ") VALUES (" + ",".join("?" * len(row)) + ")", list(row.values()))
+        doc_id = cursor.lastrowid
+        self._write_turns(doc_id, game.turns)
+        self._write_deletion_votes(doc_id, game.deletion_votes)
+        return doc_id
+
+    # Changes a game. Fields can contain game columns, a full "turns" or "deletion_votes" list to replace,
+    # and a single turn or deletion vote can be appended without touching the others. Turns can be Turn objects or dicts.
+    def update_game(self, doc_id, fields=None, add_turn=None, add_deletion_vote=None):
+        doc_id = int(doc_id)
+        fields = dict(fields or {})
+        turns = fields.pop("turns", None)
+        deletion_votes = fields.pop("deletion_votes", None)
+        row = {column : value for column, value in fields.items() if column in GAME_COLUMNS}
+        with self.connection:
+            if turns is not None:
+                turns = [as_turn(turn) for turn in turns]
+                self.connection.execute("DELETE FROM turns WHERE doc_id = ?", (doc_id,))
+                self._write_turns(doc_id, turns)
+                row.update(self._derived_game_columns(Game(code=None, map=None, turns=turns)))
+            if add_turn:
+                add_turn = as_turn(add_turn)
+                next_turn = self.connection.execute("SELECT COALESCE(MAX(turn) + 1, 0) FROM turns WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+                self._write_turns(doc_id, [add_turn], first_turn=next_turn)
+                row["last_activity"] = add_turn.timestamp
+                if next_turn == 0:
+                    row["host_user"] = add_turn.user
+                    row["host_server"] = add_turn.server
+            if deletion_votes is not None:
+                self.connection.execute("DELETE FROM deletion_votes WHERE doc_id = ?", (doc_id,))
+                self._write_deletion_votes(doc_id, deletion_votes)
+            if add_deletion_vote:
+                next_vote = self.connection.execute("SELECT COALESCE(MAX(vote) + 1, 0) FROM deletion_votes WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+                self._write_deletion_votes(doc_id, [add_deletion_vote], first_vote=next_vote)
+            assignments = "".join(column + " = ?, " for column in row.keys())
+            self.connection.execute("UPDATE games SET " + assignments + "version = version + 1 WHERE doc_id = ?", list(row.values()) + [doc_id])
+
+    # Pinboards
+    def get_pinboard(self, doc_id):
+        row = self.connection.execute("SELECT * FROM pinboards WHERE doc_id = ?", (int(doc_id),)).fetchone()
+        if row:
+            return Document(self._row_to_dict(row, PINBOARD_COLUMNS), row["doc_id"])
+        return None
+
+    def get_pinboard_for_channel(self, channel_id):
+        row = self.connection.execute("SELECT * FROM pinboards WHERE pinboards_channel = ? ORDER BY doc_id LIMIT 1", (str(channel_id),)).fetchone()
+        if row:
+            return Document(self._row_to_dict(row, PINBOARD_COLUMNS), row["doc_id"])
+        return None
+
+    # Pinboards watching this group pass which are either open for all servers or belong to the given server
+    # If only_server_id is given, only pinboards of that server are returned.
+    def search_pinboards(self, group_pass, visible_from_server="", only_server_id=None):
+        query = "SELECT * FROM pinboards WHERE pinboards_group_pass = ? AND (pinboards_server_only = 0 OR pinboards_server_id = ?)"
+        parameters = [group_pass, visible_from_server]
+        if only_server_id is not None:
+            query += " AND pinboards_server_id = ?"
+            parameters.append(only_server_id)
+        query += " ORDER BY doc_id"
+        return [Document(self._row_to_dict(row, PINBOARD_COLUMNS), row["doc_id"]) for row in self.connection.execute(query, parameters)]
+
+    def all_pinboards(self):
+        return [Document(self._row_to_dict(row, PINBOARD_COLUMNS), row["doc_id"]) for row in self.connection.execute("SELECT * FROM pinboards ORDER BY doc_id")]
+
+    def insert_pinboard(self, pinboard, doc_id=None):
+        with self.connection:
+            return self._insert_pinboard(pinboard, doc_id)
+
+    def _insert_pinboard(self, pinboard, doc_id=None):
+        row = {column : pinboard.get(column) for column in PINBOARD_COLUMNS}
+        row["pinboards_server_only"] = bool(row["pinboards_server_only"])
+        row["pinboards_server_id"] = row["pinboards_server_id"] or ""
+        row["pinboards_group_pass"] = row["pinboards_group_pass"] or ""
+        row["pinboards_hash"] = row["pinboards_hash"] or ""
+        if doc_id is not None:
+            row["doc_id"] = int(doc_id)
+        cursor = self.connection.execute("INSERT INTO pinboards (" + ", ".join(row.keys()) + ") VALUES (" + ",".join("?" * len(row)) + ")", list(row.values()))
+        return cursor.lastrowid
+
+    def update_pinboard(self, doc_id, fields):
+        with self.connection:
+            self._update_row("pinboards", int(doc_id), {column : value for column, value in fields.items() if column in PINBOARD_COLUMNS})
+
+    def remove_pinboard(self, doc_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM pinboards WHERE doc_id = ?", (int(doc_id),))
+
+    # User settings
+    def get_user_config(self, user_id):
+        row = self.connection.execute("SELECT * FROM user_config WHERE user = ?", (str(user_id),)).fetchone()
+        if row:
+            return Document(self._row_to_dict(row, USER_CONFIG_COLUMNS), row["doc_id"])
+        return None
+
+    # Inserts or replaces the settings of config["user"]. Returns the doc_id.
+    def upsert_user_config(self, config, doc_id=None):
+        with self.connection:
+            return self._upsert_user_config(config, doc_id)
+
+    def _upsert_user_config(self, config, doc_id=None):
+        row = {column : config.get(column) for column in USER_CONFIG_COLUMNS}
+        row["notifications_active"] = bool(row["notifications_active"])
+        row["notifications_server_only"] = bool(row["notifications_server_only"])
+        row["notifications_server_id"] = row["notifications_server_id"] or ""
+        row["notifications_group_pass"] = row["notifications_group_pass"] or ""
+        if doc_id is not None:
+            row["doc_id"] = int(doc_id)
+        updates = ", ".join(column + " = excluded." + column for column in USER_CONFIG_COLUMNS if column != "user")
+        self.connection.execute("INSERT INTO user_config (" + ", ".join(row.keys()) + ") VALUES (" + ",".join("?" * len(row)) + ") ON CONFLICT (user) DO UPDATE SET " + updates, list(row.values()))
+        return self.connection.execute("SELECT doc_id FROM user_config WHERE user = ?", (row["user"],)).fetchone()[0]
+
+    def update_user_config(self, doc_id, fields):
+        with self.connection:
+            self._update_row("user_config", int(doc_id), {column : value for column, value in fields.items() if column in USER_CONFIG_COLUMNS})
+
+    def all_user_configs(self):
+        return [Document(self._row_to_dict(row, USER_CONFIG_COLUMNS), row["doc_id"]) for row in self.connection.execute("SELECT * FROM user_config ORDER BY doc_id")]
+
+    # Users with active notifications for this group pass. They must either listen to all servers or have the given home server.
+    # If only_server_id is given, only users with that home server are returned.
+    def search_notification_subscribers(self, group_pass, visible_from_server="", only_server_id=None):
+        query = "SELECT * FROM user_config WHERE notifications_active = 1 AND notifications_group_pass = ? AND (notifications_server_only = 0 OR notifications_server_id = ?)"
+        parameters = [group_pass, visible_from_server]
+        if only_server_id is not None:
+            query += " AND notifications_server_id = ?"
+            parameters.append(only_server_id)
+        query += " ORDER BY doc_id"
+        return [Document(self._row_to_dict(row, USER_CONFIG_COLUMNS), row["doc_id"]) for row in self.connection.execute(query, parameters)]
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row:
+            return row["value"]
+        return default
+
+    def set_meta(self, key, value):
+        with self.connection:
+            self.connection.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+
+    # One-shot import of the old TinyDB db.json. Keeps all doc_ids, so existing select menus keep working.
+    # Runs only once per database, afterwards the json file is ignored.
+    def import_tinydb(self, json_path):
+        if self.get_meta("tinydb_imported"):
+            return False
+        if not os.path.isfile(json_path) or os.path.getsize(json_path) == 0:
+            self.set_meta("tinydb_imported", "nothing to import")
+            return False
+
+        with open(json_path, "r") as json_file:
+            tinydb_data = json.load(json_file)
+
+        games = tinydb_data.get("_default", {})
+        pinboards = tinydb_data.get("pinboards", {})
+        user_configs = tinydb_data.get("user_config", {})
+        # One transaction for everything, so a failed import leaves an empty database behind
+        with self.connection:
+            for doc_id, game in games.items():
+                self._insert_game(game, doc_id=doc_id)
+            for doc_id, pinboard in pinboards.items():
+                self._insert_pinboard(pinboard, doc_id=doc_id)
+            for doc_id, user_config in user_configs.items():
+                self._upsert_user_config(user_config, doc_id=doc_id)
+            self.connection.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", ("tinydb_imported", json_path))
+        logging.info("SqliteStorage: Imported " + str(len(games)) + " games, " + str(len(pinboards)) + " pinboards and " + str(len(user_configs)) + " user configs from " + json_path)
+        return True
+
+# Storage that keeps everything in memory and persists changes as an append-only journal.
+# Every change is one small json line, so a click costs as much disk io as the change itself.
+# The journal gets fsynced in batches and is folded into a snapshot in the background once it grows.
+# Files: <path>.snapshot.json and <path>.journal.<generation>. The snapshot knows from which generation on the journals still need to be replayed.
+# Snapshot version 1 had ISO string timestamps, version 2 has microseconds. Old journal lines are converted while they are replayed.
+SNAPSHOT_VERSION = 2
+
+class JournalStorage:
+    def __init__(self, path, sync_interval=1.0, sync_batch_size=50, compact_after=5000):
+        self.path = path
+        self.snapshot_path = path + ".snapshot.json"
+        # How long a change may wait for its fsync, and after how many waiting changes we fsync right away
+        self.sync_interval = sync_interval
+        self.sync_batch_size = sync_batch_size
+        # Journal records until a new snapshot is written
+        self.compact_after = compact_after
+
+        # doc_id -> Game
+        self.games = {}
+        self.pinboards = {}
+        self.user_configs = {}
+        self.meta = {}
+        self.next_doc_ids = {"games" : 1, "pinboards" : 1, "user_config" : 1}
+
+        self.generation = 0
+        self.journal_records = 0
+        self.unsynced_records = 0
+        self.compacting = False
+        self.background_task = None
+
+        self._load()
+        self.journal_file = open(self._journal_path(self.generation), "a", encoding="utf-8")
+        if self.snapshot_version < SNAPSHOT_VERSION and self.games:
+            # Write the converted games right away, so the old format is gone for good
+            logging.info("JournalStorage: Converting snapshot version " + str(self.snapshot_version) + " to version " + str(SNAPSHOT_VERSION))
+            snapshot, old_generation = self._start_snapshot()
+            self._write_snapshot(snapshot, old_generation)
+        logging.info("JournalStorage: Loaded " + str(len(self.games)) + " games from " + self.snapshot_path + " and " + str(self.journal_records) + " journal records")
+
+    def _journal_path(self, generation):
+        return self.path + ".journal." + str(generation)
+
+    # All journal generations that exist on disk, oldest first
+    def _journal_generations(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + ".journal."
+        generations = []
+        for filename in os.listdir(directory):
+            if filename.startswith(prefix) and filename[len(prefix):].isdigit():
+                generations.append(int(filename[len(prefix):]))
+        return sorted(generations)
+
+    # Snapshot first, then every journal record written after it
+    def _load(self):
+        self.snapshot_version = SNAPSHOT_VERSION
+        if os.path.isfile(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.snapshot_version = snapshot.get("version", 1)
+            self.games = {int(doc_id) : Game.from_dict(game, int(doc_id)) for doc_id, game in snapshot["games"].items()}
+            self.pinboards = {int(doc_id) : pinboard for doc_id, pinboard in snapshot["pinboards"].items()}
+            self.user_configs = {int(doc_id) : user_config for doc_id, user_config in snapshot["user_config"].items()}
+            self.meta = snapshot.get("meta", {})
+            self.next_doc_ids = snapshot["next_doc_ids"]
+            self.generation = snapshot["generation"]
+
+        for generation in self._journal_generations():
+            if generation < self.generation:
+                continue
+            self.generation = generation
+            self._cut_torn_line(self._journal_path(generation))
+            with open(self._journal_path(generation), "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Journals from before _cut_torn_line can have a record glued to a broken one. Everything around it is fine.
+                        logging.info("JournalStorage: Skipping broken journal line in generation " + str(generation))
+                        continue
+                    if record["op"] in ["insert_game", "update_game"] and self._has_iso_timestamps(record):
+                        self.snapshot_version = min(self.snapshot_version, 1)
+                    self._apply(record)
+                    self.journal_records += 1
+
+    # A crash in the middle of a write leaves half a line at the end of the journal. It is cut off,
+    # otherwise the next record would be appended right behind it and get lost with it on the next replay.
+    def _cut_torn_line(self, journal_path):
+        with open(journal_path, "rb+") as journal_file:
+            size = journal_file.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            journal_file.seek(size - 1)
+            if journal_file.read(1) == b"\n":
+                return
+            journal_file.seek(0)
+            complete_size = journal_file.read().rfind(b"\n") + 1
+            journal_file.truncate(complete_size)
+        logging.info("JournalStorage: Cut off " + str(size - complete_size) + " bytes of a broken journal line in " + journal_path)
+
+    # Journals written before version 2 have ISO string timestamps
+    def _has_iso_timestamps(self, record):
+        turns = record.get("value", {}).get("turns", []) + record.get("fields", {}).get("turns", [])
+        if record.get("add_turn"):
+            turns.append(record["add_turn"])
+        return any(isinstance(turn["timestamp"], str) for turn in turns)
+
+    # Applies one change to the in-memory state. Used for new changes and for replaying the journal.
+    def _apply(self, record):
+        operation = record["op"]
+        doc_id = record.get("doc_id")
+        if operation == "insert_game":
+            self.games[doc_id] = Game.from_dict(record["value"], doc_id)
+            self.next_doc_ids["games"] = max(self.next_doc_ids["games"], doc_id + 1)
+        elif operation == "update_game":
+            # The version is not in the record, replaying the journal counts it up the same way
+            game = self.games[doc_id]
+            game.version += 1
+            game.apply(record.get("fields", {}))
+            if record.get("add_turn"):
+                game.add_turn(record["add_turn"])
+            if record.get("add_deletion_vote"):
+                game.deletion_votes.append(record["add_deletion_vote"])
+        elif operation == "insert_pinboard":
+            self.pinboards[doc_id] = record["value"]
+            self.next_doc_ids["pinboards"] = max(self.next_doc_ids["pinboards"], doc_id + 1)
+        elif operation == "update_pinboard":
+            self.pinboards[doc_id].update(record["fields"])
+        elif operation == "remove_pinboard":
+            self.pinboards.pop(doc_id, None)
+        elif operation == "upsert_user_config":
+            self.user_configs[doc_id] = record["value"]
+            self.next_doc_ids["user_config"] = max(self.next_doc_ids["user_config"], doc_id + 1)
+        elif operation == "update_user_config":
+            self.user_configs[doc_id].update(record["fields"])
+        elif operation == "set_meta":
+            self.meta[record["key"]] = record["value"]
+
+    # Appends a change to the journal and applies it. The state gets what a replay would get, not the callers objects.
+    def _write(self, record):
+        line = json.dumps(record, separators=(",", ":"))
+        self._apply(json.loads(line))
+        self.journal_file.write(line + "\n")
+        self.journal_file.flush()
+        self.journal_records += 1
+        self.unsynced_records += 1
+        if self.unsynced_records >= self.sync_batch_size:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced_records:
+            os.fsync(self.journal_file.fileno())
+            self.unsynced_records = 0
+
+    def close(self):
+        if self.background_task:
+            self.background_task.cancel()
+        self.sync()
+        self.journal_file.close()
+
+    # Needs a running event loop. Fsyncs waiting changes regularly and compacts the journal when it got too long.
+    def start_background_tasks(self):
+        if not self.background_task:
+            self.background_task = asyncio.get_event_loop().create_task(self._background_loop())
+
+    async def _background_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                self.sync()
+                if self.journal_records >= self.compact_after and not self.compacting:
+                    await self.compact()
+            except Exception as e:
+                logging.info("JournalStorage: Background sync failed, " + str(e))
+
+    # Writes a new snapshot and drops the journals it contains.
+    # Switching to a new journal generation and serializing happen right away, the slow disk work runs in a thread.
+    async def compact(self):
+        self.compacting = True
+        try:
+            snapshot, old_generation = self._start_snapshot()
+            await asyncio.to_thread(self._write_snapshot, snapshot, old_generation)
+            logging.info("JournalStorage: Compacted journal into snapshot, now at generation " + str(self.generation))
+        finally:
+            self.compacting = False
+
+    # Switches to a new journal generation and serializes the current state. Returns the snapshot and the generation it replaces.
+    def _start_snapshot(self):
+        self.sync()
+        self.journal_file.close()
+        old_generation = self.generation
+        self.generation += 1
+        self.journal_file = open(self._journal_path(self.generation), "a", encoding="utf-8")
+        self.journal_records = 0
+        snapshot = json.dumps({ "version" : SNAPSHOT_VERSION,
+                                "generation" : self.generation,
+                                "next_doc_ids" : self.next_doc_ids,
+                                "games" : {doc_id : game.to_dict() for doc_id, game in self.games.items()},
+                                "pinboards" : self.pinboards,
+                                "user_config" : self.user_configs,
+                                "meta" : self.meta,
+                            }, separators=(",", ":"))
+        self.snapshot_version = SNAPSHOT_VERSION
+        return snapshot, old_generation
+
+    def _write_snapshot(self, snapshot, old_generation):
+        temporary_path = self.snapshot_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as snapshot_file:
+            snapshot_file.write(snapshot)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        # Only now the old journals are not needed anymore
+        for generation in self._journal_generations():
+            if generation <= old_generation:
+                os.remove(self._journal_path(generation))
+
+    # Callers are allowed to change what they get, so they always get copies
+    def _game_document(self, doc_id):
+        return self.games[doc_id].copy()
+
+    def get_game(self, doc_id):
+        try:
+            doc_id = int(doc_id)
+        except (TypeError, ValueError):
+            return None
+        if doc_id not in self.games:
+            return None
+        return self._game_document(doc_id)
+
+    def get_games(self, doc_ids):
+        return [self._game_document(doc_id) for doc_id in sorted(int(doc_id) for doc_id in doc_ids) if doc_id in self.games]
+
+    # Same criteria as SqliteStorage.search_games, but as a scan over the games in memory
+    def search_games(self, code=None, codes=None, status=None, not_status=None, group_pass=None, group_passes=None, has_group_pass=None, all_turns_on_server=None, participant=None):
+        results = []
+        for doc_id in sorted(self.games.keys()):
+            game = self.games[doc_id]
+            if code is not None and game.code != code:
+                continue
+            if codes is not None and game.code not in codes:
+                continue
+            if status is not None and game.status != status:
+                continue
+            if not_status is not None and game.status == not_status:
+                continue
+            if group_pass is not None and game.group_pass != group_pass:
+                continue
+            if group_passes is not None and game.group_pass not in group_passes:
+                continue
+            if has_group_pass is not None and bool(game.group_pass) != has_group_pass:
+                continue
+            if all_turns_on_server is not None and any(turn.server != all_turns_on_server for turn in game.turns):
+                continue
+            if participant is not None and participant not in game.participants:
+                continue
+            results.append(self._game_document(doc_id))
+        return results
+
+    def insert_game(self, game, doc_id=None):
+        if doc_id is None:
+            doc_id = self.next_doc_ids["games"]
+        if not isinstance(game, Game):
+            game = Game.from_dict(game)
+        self._write({"op" : "insert_game", "doc_id" : int(doc_id), "value" : game.to_dict()})
+        return int(doc_id)
+
+    def update_game(self, doc_id, fields=None, add_turn=None, add_deletion_vote=None):
+        record = {"op" : "update_game", "doc_id" : int(doc_id)}
+        fields = {column : value for column, value in (fields or {}).items() if column in GAME_COLUMNS or column in ["turns", "deletion_votes"]}
+        if "turns" in fields:
+            fields["turns"] = [as_turn(turn).to_dict() for turn in fields["turns"]]
+        if fields:
+            record["fields"] = fields
+        if add_turn:
+            record["add_turn"] = as_turn(add_turn).to_dict()
+        if add_deletion_vote:
+            record["add_deletion_vote"] = dict(add_deletion_vote)
+        self._write(record)
+
+    # Pinboards
+    def get_pinboard(self, doc_id):
+        doc_id = int(doc_id)
+        if doc_id in self.pinboards:
+            return Document(self.pinboards[doc_id], doc_id)
+        return None
+
+    def get_pinboard_for_channel(self, channel_id):
+        for doc_id in sorted(self.pinboards.keys()):
+            if self.pinboards[doc_id]["pinboards_channel"] == str(channel_id):
+                return Document(self.pinboards[doc_id], doc_id)
+        return None
+
+    def search_pinboards(self, group_pass, visible_from_server="", only_server_id=None):
+        results = []
+        for doc_id in sorted(self.pinboards.keys()):
+            pinboard = self.pinboards[doc_id]
+            if pinboard["pinboards_group_pass"] != group_pass:
+                continue
+            if pinboard["pinboards_server_only"] and pinboard["pinboards_server_id"] != visible_from_server:
+                continue
+            if only_server_id is not None and pinboard["pinboards_server_id"] != only_server_id:
+                continue
+            results.append(Document(pinboard, doc_id))
+        return results
+
+    def all_pinboards(self):
+        return [Document(self.pinboards[doc_id], doc_id) for doc_id in sorted(self.pinboards.keys())]
+
+    def insert_pinboard(self, pinboard, doc_id=None):
+        if doc_id is None:
+            doc_id = self.next_doc_ids["pinboards"]
+        value = {column : pinboard.get(column) for column in PINBOARD_COLUMNS}
+        value["pinboards_server_only"] = bool(value["pinboards_server_only"])
+        value["pinboards_server_id"] = value["pinboards_server_id"] or ""
+        value["pinboards_group_pass"] = value["pinboards_group_pass"] or ""
+        value["pinboards_hash"] = value["pinboards_hash"] or ""
+        self._write({"op" : "insert_pinboard", "doc_id" : int(doc_id), "value" : value})
+        return int(doc_id)
+
+    def update_pinboard(self, doc_id, fields):
+        self._write({"op" : "update_pinboard", "doc_id" : int(doc_id), "fields" : {column : value for column, value in fields.items() if column in PINBOARD_COLUMNS}})
+
+    def remove_pinboard(self, doc_id):
+        self._write({"op" : "remove_pinboard", "doc_id" : int(doc_id)})
+
+    # User settings
+    def get_user_config(self, user_id):
+        for doc_id, user_config in self.user_configs.items():
+            if user_config["user"] == str(user_id):
+                return Document(user_config, doc_id)
+        return None
+
+    def upsert_user_config(self, config, doc_id=None):
+        value = {column : config.get(column) for column in USER_CONFIG_COLUMNS}
+        value["user"] = str(value["user"])
+        value["notifications_active"] = bool(value["notifications_active"])
+        value["notifications_server_only"] = bool(value["notifications_server_only"])
+        value["notifications_server_id"] = value["notifications_server_id"] or ""
+        value["notifications_group_pass"] = value["notifications_group_pass"] or ""
+        existing = self.get_user_config(value["user"])
+        if existing:
+            doc_id = existing.doc_id
+        elif doc_id is None:
+            doc_id = self.next_doc_ids["user_config"]
+        self._write({"op" : "upsert_user_config", "doc_id" : int(doc_id), "value" : value})
+        return int(doc_id)
+
+    def update_user_config(self, doc_id, fields):
+        self._write({"op" : "update_user_config", "doc_id" : int(doc_id), "fields" : {column : value for column, value in fields.items() if column in USER_CONFIG_COLUMNS}})
+
+    def all_user_configs(self):
+        return [Document(self.user_configs[doc_id], doc_id) for doc_id in sorted(self.user_configs.keys())]
+
+    def search_notification_subscribers(self, group_pass, visible_from_server="", only_server_id=None):
+        results = []
+        for doc_id in sorted(self.user_configs.keys()):
+            user_config = self.user_configs[doc_id]
+            if not user_config["notifications_active"] or user_config["notifications_group_pass"] != group_pass:
+                continue
+            if user_config["notifications_server_only"] and user_config["notifications_server_id"] != visible_from_server:
+                continue
+            if only_server_id is not None and user_config["notifications_server_id"] != only_server_id:
+                continue
+            results.append(Document(user_config, doc_id))
+        return results
+
+    def get_meta(self, key, default=None):
+        return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self._write({"op" : "set_meta", "key" : key, "value" : value})
+
+    # One-shot import of the old TinyDB db.json, same as for SqliteStorage. The result goes straight into a snapshot.
+    def import_tinydb(self, json_path):
+        if self.get_meta("tinydb_imported"):
+            return False
+        if not os.path.isfile(json_path) or os.path.getsize(json_path) == 0:
+            self.set_meta("tinydb_imported", "nothing to import")
+            return False
+
+        with open(json_path, "r") as json_file:
+            tinydb_data = json.load(json_file)
+
+        games = tinydb_data.get("_default", {})
+        pinboards = tinydb_data.get("pinboards", {})
+        user_configs = tinydb_data.get("user_config", {})
+        for doc_id, game in games.items():
+            self.insert_game(game, doc_id=doc_id)
+        for doc_id, pinboard in pinboards.items():
+            self.insert_pinboard(pinboard, doc_id=doc_id)
+        for doc_id, user_config in user_configs.items():
+            self.upsert_user_config(user_config, doc_id=doc_id)
+        self.set_meta("tinydb_imported", json_path)
+        self.sync()
+        logging.info("JournalStorage: Imported " + str(len(games)) + " games, " + str(len(pinboards)) + " pinboards and " + str(len(user_configs)) + " user configs from " + json_path)
+        return True
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import re
 import interactions
 
@@ -28,4 +30,45 @@ def stringToFilename(string):
     filename = re.sub(r'\s+', '_', filename)
     # Convert to lowercase
     filename = filename.lower()
-    return filename
\ No newline at end of file
+    return filename
+# Components carry what their handler needs in the custom_id, like "game_list_page:n:open:0:1h2k3ddd1s:2x:". Discord allows at most 100 characters.
+CUSTOM_ID_MAX_LENGTH = 100
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Numbers in custom_ids are written in base 36 to save room
+def to_base36(number):
+    if number < 0:
+        return "-" + to_base36(-number)
+    text = ""
+    while True:
+        number, digit = divmod(number, 36)
+        text = BASE36_DIGITS[digit] + text
+        if number == 0:
+            return text
+
+def from_base36(text):
+    return int(text, 36)
+
+# Builds a custom_id from a name and its fields. Only the last field may contain ":". Returns None if it gets too long for discord.
+def encode_custom_id(name, *fields):
+    custom_id = ":".join([name] + [str(field) for field in fields])
+    if len(custom_id) > CUSTOM_ID_MAX_LENGTH:
+        return None
+    return custom_id
+
+# The fields of a custom_id made by encode_custom_id with field_count fields
+def decode_custom_id(custom_id, field_count):
+    return custom_id.split(":", field_count)[1:]
+
+# Fingerprint of what a message shows. The embed timestamp is left out, it changes on every render without changing anything visible.
+def message_content_hash(embed, components):
+    def serialize(value):
+        if isinstance(value, (list, tuple)):
+            return [serialize(item) for item in value]
+        if hasattr(value, "_json"):
+            return value._json
+        return value
+    embed_json = dict(embed._json)
+    embed_json.pop("timestamp", None)
+    content = json.dumps([embed_json, serialize(components)], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()